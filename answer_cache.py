@@ -0,0 +1,176 @@
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+import numpy as np
+from embedding_utils import fold_plural
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of cached answers across all tenants
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+# Seconds a cached answer stays valid
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+# Cosine similarity above which two questions with no content terms (such as
+# greetings) count as the same question; others match on content terms alone
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.9"))
+
+# Width of the hashed character-trigram vectors used to compare questions
+_QUESTION_DIM = 2048
+
+# Words that can differ between two phrasings of the same question; "what"
+# is the only question word among them, since "where" and "when" ask
+# different things
+_STOPWORDS = {
+    'what', 'whats', 's',
+    'a', 'an', 'the', 'is', 'are', 'was', 'do', 'does', 'did', 'you', 'your', 'we', 'our',
+    'i', 'me', 'my', 'have', 'has', 'any', 'some', 'of', 'for', 'to', 'in', 'on', 'at',
+    'it', 'this', 'that', 'there', 'please', 'can', 'could', 'would', 'tell', 'about',
+    'hi', 'hello', 'hey', 'and', 'or', 'with', 'be', 'get', 'got'
+}
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+def normalize_question(text):
+    """Lower-case a question and strip punctuation and extra whitespace."""
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text.lower())).strip()
+
+def content_terms(normalized):
+    """The words of a normalised question that decide what it asks.
+
+    Stopwords are dropped and a plural "s" is trimmed, but numbers and
+    units ("1kg", "500", "ml") are kept exactly, so two questions about
+    different sizes or quantities never share an answer.
+    """
+    terms = set()
+    for word in normalized.split():
+        if word in _STOPWORDS:
+            continue
+        terms.add(fold_plural(word))
+    return frozenset(terms)
+
+def question_vector(normalized):
+    """Hashed character-trigram vector of a normalised question.
+
+    Unlike the tenant's TF-IDF embedder this keeps every word, including
+    the ones that change what is being asked ("price" vs "have").
+    """
+    vector = np.zeros(_QUESTION_DIM, dtype=np.float32)
+    padded = f" {normalized} "
+    for i in range(len(padded) - 2):
+        vector[zlib.crc32(padded[i:i + 3].encode("utf-8")) % _QUESTION_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class AnswerCache:
+    """Per-tenant cache of generated answers.
+
+    Answers are keyed by tenant, corpus generation and normalised
+    question. A lookup that misses on the exact question falls back to
+    the most similar cached question of the same tenant and generation
+    that has exactly the same content terms (see content_terms), so
+    rephrasings match however they are worded, but never a question about
+    another size or item. Questions without content terms only match
+    above ``similarity``.
+    Entries expire after ``ttl`` seconds and the least recently used ones
+    are evicted beyond ``max_entries``. Bumping a tenant's generation
+    (re-ingest) makes all their entries unreachable.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                 similarity=ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        # (user_id, generation, question) -> (answer, vector, created_at, terms)
+        self._entries = OrderedDict()
+        # (user_id, generation) -> (keys, matrix) for similarity search
+        self._matrices = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        self._matrices.pop(key[:2], None)
+
+    def _matrix(self, user_id, generation):
+        cached = self._matrices.get((user_id, generation))
+        if cached is None:
+            keys = [key for key in self._entries if key[0] == user_id and key[1] == generation]
+            matrix = np.vstack([self._entries[key][1] for key in keys]) if keys else None
+            cached = (keys, matrix)
+            self._matrices[(user_id, generation)] = cached
+        return cached
+
+    def get(self, user_id, generation, question):
+        """Return a cached answer for the question, or None."""
+        normalized = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            key = (user_id, generation, normalized)
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[2] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._drop(key)
+
+            keys, matrix = self._matrix(user_id, generation)
+            if matrix is not None:
+                scores = matrix @ question_vector(normalized)
+                terms = content_terms(normalized)
+                for best in np.argsort(-scores):
+                    best_key = keys[best]
+                    best_entry = self._entries.get(best_key)
+                    if best_entry is None or best_entry[3] != terms:
+                        continue
+                    if not terms and scores[best] < self.similarity:
+                        break
+                    if now - best_entry[2] <= self.ttl:
+                        self._entries.move_to_end(best_key)
+                        self.near_hits += 1
+                        return best_entry[0]
+                    self._drop(best_key)
+                    break
+
+            self.misses += 1
+            return None
+
+    def put(self, user_id, generation, question, answer):
+        """Cache an answer for a question under the tenant's generation."""
+        normalized = normalize_question(question)
+        if not normalized or not answer:
+            return
+        with self._lock:
+            key = (user_id, generation, normalized)
+            self._entries[key] = (answer, question_vector(normalized), time.time(), content_terms(normalized))
+            self._entries.move_to_end(key)
+            self._matrices.pop((user_id, generation), None)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._matrices.pop(evicted[:2], None)
+
+    def invalidate(self, user_id):
+        """Drop every cached answer of a tenant."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                self._drop(key)
+
+    def stats(self):
+        """Hit/miss counters and current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "entries": len(self._entries)
+            }
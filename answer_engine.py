@@ -0,0 +1,351 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from gemini_models import get_model
+from chroma_utils import query_chroma_many, get_user_generation
+from context_packer import pack_context
+
+logger = logging.getLogger(__name__)
+
+# Most results retrieved per question; adaptive retrieval usually keeps fewer
+CONTEXT_RESULTS = 10
+
+# The persona, sent once as the model's system instruction
+SYSTEM_INSTRUCTION = """You are a friendly and knowledgeable customer service representative for a bakery business. Your role is to help customers with their inquiries about products, pricing, and services.
+
+Each message gives you context from the bakery's product database followed by the customer's question.
+
+Please respond as a helpful customer service representative who:
+1. **Speaks in a warm, friendly, and conversational tone** - like you're talking to a friend
+2. **Gives SHORT, CONCISE answers** - keep responses brief and to the point
+3. **Directly answers the customer's question** using the product information available
+4. **Provides specific details** about products, prices, and features when asked
+5. **Uses natural, everyday language** - avoid overly formal or technical business jargon
+6. **Shows enthusiasm** about the products
+7. **Mention specific product names, prices, and descriptions** from the data when relevant
+8. **Be proactive** - if someone asks about one product, briefly suggest 1-2 related items
+9. **Keep responses under 3-4 sentences** unless the customer asks for detailed information
+
+**Response Style Guidelines:**
+- Start with a friendly greeting or acknowledgment
+- Use "we" and "our" to show you're representing the bakery
+- Include specific prices and product names from the data
+- Keep it brief and conversational
+- Use emojis sparingly (1-2 max per response)
+
+**Example short responses:**
+- "Hi! Yes, we have the Overload Brownie for ₹120 - it's packed with rich dark chocolate! 🍫"
+- "Our Mava Cake is ₹310 and it's one of our most popular items!"
+- "We have several brownie options starting at ₹110. Would you like me to tell you about our eggless varieties?"
+
+Remember: Keep responses short, friendly, and informative!"""
+
+# What is sent per question
+PROMPT_TEMPLATE = """Context from the bakery's product database:
+{context}
+
+Customer's question: {question}"""
+
+# Replies when nothing relevant is found, per channel
+CHAT_NO_CONTEXT_RESPONSE = "Hi! I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question (e.g., 'Do you have chocolate brownies?' instead of 'brownies')\n2. Asking about a specific product category (like 'tea cakes' or 'brownies')\n3. Or just ask me about our general product offerings! I'm here to help! 😊"
+TELEGRAM_NO_CONTEXT_RESPONSE = "Hi! 👋 I'm your bakery assistant. I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question\n2. Asking about a specific product category\n3. Or just ask me about our general offerings! I'm here to help! 😊"
+TEST_NO_CONTEXT_RESPONSE = "Hi! I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question\n2. Asking about a specific product category\n3. Or just ask me about our general offerings! I'm here to help! 😊"
+
+class PromptTemplate:
+    """A prompt split once around its placeholders, so rendering is a join."""
+
+    def __init__(self, template, fields=("context", "question")):
+        self.fields = fields
+        self._parts = []
+        rest = template
+        for field in fields:
+            head, rest = rest.split("{" + field + "}", 1)
+            self._parts.append(head)
+        self._parts.append(rest)
+
+    def render(self, **values):
+        pieces = [self._parts[0]]
+        for field, part in zip(self.fields, self._parts[1:]):
+            pieces.append(values[field])
+            pieces.append(part)
+        return "".join(pieces)
+
+prompt_template = PromptTemplate(PROMPT_TEMPLATE)
+
+class StageMetrics:
+    """Running count, total and worst duration of every answer stage."""
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            count, total, worst = self._stages.get(stage, (0, 0.0, 0.0))
+            self._stages[stage] = (count + 1, total + seconds, max(worst, seconds))
+
+    def snapshot(self):
+        """Per-stage count, average and maximum in milliseconds."""
+        with self._lock:
+            return {
+                stage: {
+                    "count": count,
+                    "avg_ms": round(total / count * 1000, 2),
+                    "max_ms": round(worst * 1000, 2)
+                }
+                for stage, (count, total, worst) in self._stages.items()
+            }
+
+class Answer:
+    """One question on its way through the answer stages."""
+
+    def __init__(self, question, no_context_response, use_cache, metrics):
+        self.question = question
+        self.no_context_response = no_context_response
+        self.use_cache = use_cache
+        self.generation = None
+        self.results = None
+        # Candidates, chosen k, threshold and relevance scores of the retrieval
+        self.retrieval = None
+        self.context = None
+        self.context_tokens = 0
+        self.prompt = None
+        self.text = None
+        # "cache", "generated" or "no_context" once answered
+        self.source = None
+        self.error = None
+        self.failed_stage = None
+        self.timings = {}
+        self.started = time.perf_counter()
+        self._metrics = metrics
+
+    @property
+    def done(self):
+        return self.text is not None or self.error is not None
+
+    def finish(self, text, source):
+        self.text = text
+        self.source = source
+
+    def fail(self, stage, error):
+        self.error = error
+        self.failed_stage = stage
+
+    @contextmanager
+    def timer(self, stage):
+        """Time a step done outside the engine, such as sending the reply."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+            self._metrics.record(stage, elapsed)
+
+def cache_stage(engine, user_id, answers):
+    """Answer repeated questions from the answer cache."""
+    generation = get_user_generation(user_id)
+    for answer in answers:
+        answer.generation = generation
+        if answer.use_cache and engine.answer_cache is not None:
+            cached = engine.answer_cache.get(user_id, generation, answer.question)
+            if cached:
+                answer.finish(cached, "cache")
+
+def catalog_stage(engine, user_id, answers):
+    """Use the whole catalog as context when it is small enough (see CatalogContext)."""
+    if engine.catalog is None:
+        return
+    block = engine.catalog.get(user_id, answers[0].generation)
+    if block is None:
+        return
+    context, tokens, items = block
+    for answer in answers:
+        answer.context = context
+        answer.context_tokens = tokens
+        answer.retrieval = {"mode": "catalog", "k": items, "tokens": tokens}
+
+def retrieve_stage(engine, user_id, answers):
+    """Retrieve relevant context for every remaining question in one round."""
+    answers = [answer for answer in answers if answer.context is None]
+    if not answers:
+        return
+    retrieved = query_chroma_many([answer.question for answer in answers], user_id,
+                                  n_results=CONTEXT_RESULTS, adaptive=True)
+    if retrieved is None:
+        retrieved = [None] * len(answers)
+    for answer, results in zip(answers, retrieved):
+        if not results or not results.get('documents'):
+            answer.finish(answer.no_context_response, "no_context")
+        else:
+            answer.results = results
+            answer.retrieval = results.get('diagnostics')
+            if answer.retrieval:
+                logger.info(f"Kept {answer.retrieval['k']} of {answer.retrieval['candidates']} hits "
+                            f"at relevance >= {answer.retrieval['cutoff']}")
+
+def context_stage(engine, user_id, answers):
+    """Pack retrieved documents into compact prompt context (see pack_context)."""
+    for answer in answers:
+        if answer.context is not None:
+            continue
+        context, tokens, items = pack_context(answer.results)
+        if not context:
+            answer.finish(answer.no_context_response, "no_context")
+        else:
+            answer.context = context
+            answer.context_tokens = tokens
+            logger.info(f"Packed {items} items into ~{tokens} context tokens")
+
+def prompt_stage(engine, user_id, answers):
+    """Render the prompt for every remaining question."""
+    for answer in answers:
+        answer.prompt = prompt_template.render(context=answer.context, question=answer.question)
+
+def generate_stage(engine, user_id, answers):
+    """Generate a reply per question; one failure does not fail the others."""
+    model = get_model(system_instruction=SYSTEM_INSTRUCTION)
+    for answer in answers:
+        try:
+            response = model.generate_content(answer.prompt)
+            answer.finish(response.text, "generated")
+        except Exception as e:
+            logger.error(f"Gemini API error: {str(e)}")
+            answer.fail("generate", e)
+
+def remember_stage(engine, user_id, answers):
+    """Cache generated replies for repeated questions."""
+    if engine.answer_cache is None:
+        return
+    for answer in answers:
+        if answer.use_cache and answer.source == "generated":
+            engine.answer_cache.put(user_id, answer.generation, answer.question, answer.text)
+
+DEFAULT_STAGES = [
+    ("cache", cache_stage),
+    ("catalog", catalog_stage),
+    ("retrieve", retrieve_stage),
+    ("context", context_stage),
+    ("prompt", prompt_stage),
+    ("generate", generate_stage),
+    ("remember", remember_stage),
+]
+
+class AnswerEngine:
+    """Answers customer questions for every channel through one pipeline.
+
+    A pipeline is a list of ``(name, stage)`` pairs. Each stage is called
+    as ``stage(engine, user_id, answers)`` with the answers still in
+    flight, and finishes or fails them as it goes; answers that are done
+    skip the remaining stages except ``remember``. Every stage is timed,
+    logged with the answer and added to ``metrics``. Questions answered
+    together share one retrieval round; tenants whose whole catalog fits
+    in the prompt (``catalog``) skip retrieval altogether.
+    """
+
+    def __init__(self, answer_cache=None, catalog=None, stages=None):
+        self.answer_cache = answer_cache
+        self.catalog = catalog
+        self.stages = list(stages or DEFAULT_STAGES)
+        self.metrics = StageMetrics()
+
+    def replace_stage(self, name, stage):
+        """Swap the stage called ``name`` for another implementation."""
+        self.stages = [(n, stage if n == name else s) for n, s in self.stages]
+
+    def answer(self, user_id, question, no_context_response=CHAT_NO_CONTEXT_RESPONSE, use_cache=True):
+        """Answer one question; see ``answer_many``."""
+        return self.answer_many(user_id, [question], no_context_response, use_cache)[0]
+
+    def answer_many(self, user_id, questions, no_context_response=CHAT_NO_CONTEXT_RESPONSE, use_cache=True):
+        """Answer questions for one user, returning an Answer per question.
+
+        Answers never raise: a failed one has ``error`` and
+        ``failed_stage`` set and no ``text``.
+        """
+        answers = [Answer(question, no_context_response, use_cache, self.metrics) for question in questions]
+        self._run(user_id, answers, self.stages)
+        self._log(user_id, answers)
+        return answers
+
+    def stream(self, user_id, question, no_context_response=CHAT_NO_CONTEXT_RESPONSE, use_cache=True):
+        """Answer one question, streaming the reply as the model writes it.
+
+        Runs the stages before ``generate`` like ``answer`` does and
+        returns ``(answer, chunks)``. Iterating ``chunks`` yields the reply
+        text piece by piece (a cached or no-context reply comes as one
+        piece), then runs the remaining stages; ``answer`` is complete
+        once it is exhausted or closed. A failed stream sets
+        ``answer.error`` and ends early; so does closing it early, in
+        which case the partial reply is not cached. The ``first_token``
+        timing is the time to the first piece of generated text.
+        """
+        answer = Answer(question, no_context_response, use_cache, self.metrics)
+        names = [name for name, _ in self.stages]
+        split = names.index("generate") if "generate" in names else len(names)
+        self._run(user_id, [answer], self.stages[:split])
+
+        def chunks():
+            try:
+                if answer.text is not None:
+                    yield answer.text
+                elif answer.error is None:
+                    pieces = []
+                    try:
+                        with answer.timer("generate"):
+                            model = get_model(system_instruction=SYSTEM_INSTRUCTION)
+                            for chunk in model.generate_content(answer.prompt, stream=True):
+                                # Blocked or finish-only chunks carry no text
+                                if not chunk.parts:
+                                    continue
+                                text = chunk.text
+                                if not text:
+                                    continue
+                                if not pieces:
+                                    first_token = time.perf_counter() - answer.started
+                                    answer.timings["first_token"] = first_token
+                                    self.metrics.record("first_token", first_token)
+                                pieces.append(text)
+                                yield text
+                        if not pieces:
+                            raise ValueError("Gemini returned no text")
+                        answer.finish("".join(pieces), "generated")
+                    except GeneratorExit:
+                        # A partial reply must not be cached
+                        answer.fail("generate", ConnectionAbortedError("Client disconnected during streaming"))
+                        raise
+                    except Exception as e:
+                        logger.error(f"Gemini streaming error: {str(e)}")
+                        answer.fail("generate", e)
+            finally:
+                self._run(user_id, [answer], self.stages[split + 1:])
+                self._log(user_id, [answer])
+
+        return answer, chunks()
+
+    def _run(self, user_id, answers, stages):
+        for name, stage in stages:
+            # Caching still sees answers finished by earlier stages
+            pending = [answer for answer in answers if answer.error is None] if name == "remember" else [
+                answer for answer in answers if not answer.done
+            ]
+            if not pending:
+                continue
+            started = time.perf_counter()
+            try:
+                stage(self, user_id, pending)
+            except Exception as e:
+                logger.error(f"Answer stage {name} failed for user {user_id}: {str(e)}")
+                for answer in pending:
+                    if not answer.done:
+                        answer.fail(name, e)
+            elapsed = time.perf_counter() - started
+            self.metrics.record(name, elapsed)
+            for answer in pending:
+                answer.timings[name] = elapsed
+
+    def _log(self, user_id, answers):
+        for answer in answers:
+            stages = ", ".join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in answer.timings.items())
+            logger.info(f"Answered for user {user_id} from {answer.source or answer.failed_stage}: {stages}")
@@ -4,7 +4,7 @@ Flask Web Application for BusinessAI Platform
 Handles file upload, text extraction, web scraping, and AI-powered data extraction
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import json
 import os
@@ -22,7 +22,15 @@ import urllib3
 import logging
 from datetime import datetime
 from supabase.client import create_client, Client
-from chroma_utils import store_data_in_chroma, query_chroma
+from chroma_utils import (
+    store_data_in_chroma, delete_user_data, get_resident_tenants,
+    get_user_min_relevance, set_user_min_relevance
+)
+from answer_cache import AnswerCache
+from gemini_models import get_model
+from catalog_context import CatalogContext
+from answer_engine import AnswerEngine, CHAT_NO_CONTEXT_RESPONSE, TELEGRAM_NO_CONTEXT_RESPONSE, TEST_NO_CONTEXT_RESPONSE
+from tenant_warmer import TenantWarmer
 import threading
 import time
 
@@ -52,10 +60,8 @@ if not api_key:
     logger.error("Looking for .env file in: " + os.path.abspath(".env"))
 else:
     try:
-        # Configure the API key
+        # Configure the API key; models are built on first use (see gemini_models)
         genai.configure(api_key=api_key)
-        # Test the configuration
-        model = genai.GenerativeModel('gemini-1.5-flash')
         logger.info("Successfully configured Gemini API")
     except Exception as e:
         logger.error(f"Failed to configure Gemini API: {str(e)}")
@@ -76,6 +82,19 @@ telegram_settings = {}
 # Track processed message IDs to avoid duplicates
 processed_message_ids = set()
 
+# Generated answers, reused for repeated and near-duplicate questions
+answer_cache = AnswerCache()
+
+# Whole-catalog context for tenants small enough to skip retrieval
+catalog_context = CatalogContext()
+
+# Retrieval, prompting and generation shared by the web chat and Telegram
+answer_engine = AnswerEngine(answer_cache, catalog_context)
+
+# Loads recently active tenants in the background so their first chat after
+# a restart does not pay for opening their index; started by the first request
+tenant_warmer = TenantWarmer()
+
 class TelegramBot:
     """Telegram bot handler for customer service."""
     
@@ -299,8 +318,6 @@ class DataProcessor:
             try:
                 # Configure the API key
                 genai.configure(api_key=self.api_key)
-                # Test the configuration
-                model = genai.GenerativeModel('gemini-1.5-flash')
                 logger.info("Successfully configured Gemini API in DataProcessor")
             except Exception as e:
                 logger.error(f"Failed to configure Gemini API in DataProcessor: {str(e)}")
@@ -439,14 +456,11 @@ Content to analyze:
             content_preview = content[:15000] if len(content) > 15000 else content
             
             try:
-                # Create the model
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                
-                # Create the chat
-                chat = model.start_chat(history=[])
+                # Shared extraction model, with its system message set once
+                model = get_model(system_instruction=system_message)
                 
                 # Send the message
-                response = chat.send_message(f"{system_message}\n\n{user_message}\n\n{content_preview}")
+                response = model.generate_content(f"{user_message}\n\n{content_preview}")
                 
                 # Get the response text
                 llm_response = response.text
@@ -775,15 +789,40 @@ def get_content_types():
     """Get available content types."""
     return jsonify(processor.get_content_type_options())
 
+@app.before_request
+def start_tenant_warmer():
+    """Start warming tenants in whichever process serves requests.
+
+    This runs under app.py, run_server.py and gunicorn workers alike (a
+    readiness probe's first health check is enough), while the debug
+    reloader's watcher process and forking masters never serve a request.
+    """
+    tenant_warmer.start()
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint with system status."""
+    residency = get_resident_tenants()
     return jsonify({
         "status": "healthy",
+        "ready": tenant_warmer.ready,
+        "warmup": tenant_warmer.status(),
         "timestamp": datetime.now().isoformat(),
         "api_key_configured": bool(processor.api_key),
         "supported_file_types": list(ALLOWED_EXTENSIONS),
-        "max_file_size_mb": app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+        "max_file_size_mb": app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024),
+        "resident_tenants": residency["resident_tenants"],
+        "resident_index_mb": round(residency["resident_bytes"] / (1024 * 1024), 1)
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Timings of the answer stages and cache statistics."""
+    return jsonify({
+        "answer_stages": answer_engine.metrics.snapshot(),
+        "answer_cache": answer_cache.stats(),
+        "resident_tenants": get_resident_tenants(),
+        "timestamp": datetime.now().isoformat()
     })
 
 @app.route('/api/save', methods=['POST'])
@@ -923,7 +962,9 @@ def store_chroma():
         if not user_id:
             return jsonify({'error': 'User ID is required'}), 400
 
-        success = store_data_in_chroma(data, user_id)
+        success = store_data_in_chroma(data, user_id, content_type=request.json.get('content_type'))
+        answer_cache.invalidate(user_id)
+        catalog_context.invalidate(user_id)
         if success:
             return jsonify({'message': 'Data successfully stored in ChromaDB'}), 200
         else:
@@ -957,101 +998,84 @@ def chat():
                 "error": "AI model is not properly configured. Please contact your administrator to set up the GEMINI_API_KEY."
             }), 500
             
-        # Get relevant context from ChromaDB
-        try:
-            logger.info(f"Querying ChromaDB for user {user_id} with message: {message[:100]}...")
-            # Query ChromaDB for relevant context with more results
-            results = query_chroma(message, user_id, n_results=10)  # Increased from 5 to 10
-            
-            logger.info(f"ChromaDB query results: {results}")
-            
-            if not results or not results.get('documents'):
-                logger.warning(f"No results found in ChromaDB for user {user_id}")
-                return jsonify({
-                    "response": "Hi! I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question (e.g., 'Do you have chocolate brownies?' instead of 'brownies')\n2. Asking about a specific product category (like 'tea cakes' or 'brownies')\n3. Or just ask me about our general product offerings! I'm here to help! 😊"
-                })
-            
-            # Extract relevant context from results
-            context = []
-            for doc, metadata in zip(results['documents'][0], results['metadatas'][0]):
-                if doc:  # Ensure document is not None
-                    try:
-                        # Try to parse the document as JSON for better formatting
-                        parsed_doc = json.loads(doc)
-                        # Add metadata to the document for better context
-                        parsed_doc['metadata'] = metadata
-                        context.append(json.dumps(parsed_doc, indent=2))
-                    except json.JSONDecodeError:
-                        # If not JSON, use as is
-                        context.append(doc)
-            
-            logger.info(f"Extracted {len(context)} context items")
-            
-            # If no valid context found, return a default message
-            if not context:
-                logger.warning(f"No valid context found in ChromaDB results for user {user_id}")
-                return jsonify({
-                    "response": "Hi! I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question (e.g., 'Do you have chocolate brownies?' instead of 'brownies')\n2. Asking about a specific product category (like 'tea cakes' or 'brownies')\n3. Or just ask me about our general product offerings! I'm here to help! 😊"
-                })
-            
-            # Generate response using the context
-            try:
-                logger.info(f"Generating response using Gemini API for user {user_id}")
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                prompt = f"""You are a friendly and knowledgeable customer service representative for a bakery business. Your role is to help customers with their inquiries about products, pricing, and services.
-
-Context from the bakery's product database:
-{chr(10).join(context)}
-
-Customer's question: {message}
-
-Please respond as a helpful customer service representative who:
-1. **Speaks in a warm, friendly, and conversational tone** - like you're talking to a friend
-2. **Gives SHORT, CONCISE answers** - keep responses brief and to the point
-3. **Directly answers the customer's question** using the product information available
-4. **Provides specific details** about products, prices, and features when asked
-5. **Uses natural, everyday language** - avoid overly formal or technical business jargon
-6. **Shows enthusiasm** about the products
-7. **Mention specific product names, prices, and descriptions** from the data when relevant
-8. **Be proactive** - if someone asks about one product, briefly suggest 1-2 related items
-9. **Keep responses under 3-4 sentences** unless the customer asks for detailed information
-
-**Response Style Guidelines:**
-- Start with a friendly greeting or acknowledgment
-- Use "we" and "our" to show you're representing the bakery
-- Include specific prices and product names from the data
-- Keep it brief and conversational
-- Use emojis sparingly (1-2 max per response)
-
-**Example short responses:**
-- "Hi! Yes, we have the Overload Brownie for ₹120 - it's packed with rich dark chocolate! 🍫"
-- "Our Mava Cake is ₹310 and it's one of our most popular items!"
-- "We have several brownie options starting at ₹110. Would you like me to tell you about our eggless varieties?"
-
-Remember: Keep responses short, friendly, and informative!"""
-
-                response = model.generate_content(prompt)
-                logger.info(f"Successfully generated response for user {user_id}")
-                
-                return jsonify({
-                    "response": response.text
-                })
-            except Exception as e:
-                logger.error(f"Gemini API error: {str(e)}")
-                return jsonify({
-                    "error": "Failed to generate response from AI model. Please try again later."
-                }), 500
-                
-        except Exception as e:
-            logger.error(f"ChromaDB query error: {str(e)}")
+        answer = answer_engine.answer(user_id, message, no_context_response=CHAT_NO_CONTEXT_RESPONSE)
+        if answer.failed_stage == "generate":
+            return jsonify({
+                "error": "Failed to generate response from AI model. Please try again later."
+            }), 500
+        if answer.error:
             return jsonify({
                 "error": "Failed to retrieve context from database. Please make sure you've stored some data first."
             }), 500
+        
+        response = {"response": answer.text}
+        if data.get('debug'):
+            response["retrieval"] = answer.retrieval
+            response["timings"] = {stage: round(seconds * 1000, 2) for stage, seconds in answer.timings.items()}
+        return jsonify(response)
             
     except Exception as e:
         logger.error(f"Chat API error: {str(e)}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+def sse_event(event, data):
+    """One Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming variant of /api/chat over Server-Sent Events.
+
+    Sends ``token`` events with pieces of the reply as Gemini generates
+    them, then a ``done`` event with the full response, its source,
+    retrieval diagnostics and stage timings, or an ``error`` event if
+    generation fails midway.
+    """
+    try:
+        data = request.get_json()
+        message = data.get('message')
+        user_id = data.get('user_id')
+
+        if not message:
+            return jsonify({"error": "No message provided"}), 400
+        if not user_id:
+            return jsonify({"error": "User ID is required"}), 400
+        if not os.environ.get("GEMINI_API_KEY"):
+            logger.error("GEMINI_API_KEY not configured")
+            return jsonify({
+                "error": "AI model is not properly configured. Please contact your administrator to set up the GEMINI_API_KEY."
+            }), 500
+
+        logger.info(f"Streaming chat request received - Message: {message[:100]}..., User ID: {user_id}")
+        answer, chunks = answer_engine.stream(user_id, message, no_context_response=CHAT_NO_CONTEXT_RESPONSE)
+        if answer.error:
+            return jsonify({
+                "error": "Failed to retrieve context from database. Please make sure you've stored some data first."
+            }), 500
+
+        def events():
+            for text in chunks:
+                yield sse_event("token", {"text": text})
+            if answer.error:
+                yield sse_event("error", {"error": "Failed to generate response from AI model. Please try again later."})
+                return
+            yield sse_event("done", {
+                "response": answer.text,
+                "source": answer.source,
+                "retrieval": answer.retrieval,
+                "timings": {stage: round(seconds * 1000, 2) for stage, seconds in answer.timings.items()}
+            })
+
+        return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            # Keep reverse proxies from buffering the stream
+            'X-Accel-Buffering': 'no'
+        })
+
+    except Exception as e:
+        logger.error(f"Streaming chat API error: {str(e)}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
 @app.route('/api/delete-chroma', methods=['POST'])
 def delete_chroma():
     """API endpoint for deleting user data from ChromaDB."""
@@ -1063,6 +1087,8 @@ def delete_chroma():
             return jsonify({"error": "User ID is required"}), 400
             
         success = delete_user_data(user_id)
+        answer_cache.invalidate(user_id)
+        catalog_context.invalidate(user_id)
         if success:
             return jsonify({"message": "User data successfully deleted from ChromaDB"}), 200
         else:
@@ -1147,6 +1173,36 @@ def get_settings():
         logger.error(f"Error getting settings: {str(e)}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@app.route('/api/settings/retrieval', methods=['GET', 'POST'])
+def retrieval_settings():
+    """Get or set a user's relevance threshold for retrieved context."""
+    try:
+        data = request.get_json() if request.method == 'POST' else request.args
+        user_id = data.get('user_id')
+        if not user_id:
+            return jsonify({"error": "User ID is required"}), 400
+
+        if request.method == 'POST':
+            min_relevance = data.get('min_relevance')
+            if min_relevance is not None:
+                try:
+                    min_relevance = float(min_relevance)
+                except (TypeError, ValueError):
+                    return jsonify({"error": "min_relevance must be a number"}), 400
+                if not 0.0 <= min_relevance <= 1.0:
+                    return jsonify({"error": "min_relevance must be between 0 and 1"}), 400
+            if not set_user_min_relevance(user_id, min_relevance):
+                return jsonify({"error": "Failed to save retrieval settings"}), 500
+            answer_cache.invalidate(user_id)
+
+        return jsonify({
+            "success": True,
+            "settings": {"min_relevance": get_user_min_relevance(user_id)}
+        }), 200
+    except Exception as e:
+        logger.error(f"Error in retrieval settings: {str(e)}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
 @app.route('/api/settings/telegram', methods=['POST'])
 def save_telegram_settings():
     """Save Telegram bot settings - simplified version."""
@@ -1283,71 +1339,15 @@ def telegram_webhook():
         
         # Process ANY message (including /start) using AI
         try:
-            logger.info("Getting context from ChromaDB...")
-            # Get relevant context from ChromaDB
-            results = query_chroma(text, target_user_id, n_results=10)
-            
-            if not results or not results.get('documents'):
-                logger.warning("No data found in ChromaDB")
-                response_text = "Hi! 👋 I'm your bakery assistant. I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question\n2. Asking about a specific product category\n3. Or just ask me about our general offerings! I'm here to help! 😊"
-            else:
-                logger.info(f"Found {len(results['documents'][0])} documents in ChromaDB")
-                # Extract relevant context from results
-                context = []
-                for doc, metadata in zip(results['documents'][0], results['metadatas'][0]):
-                    if doc:
-                        try:
-                            parsed_doc = json.loads(doc)
-                            parsed_doc['metadata'] = metadata
-                            context.append(json.dumps(parsed_doc, indent=2))
-                        except json.JSONDecodeError:
-                            context.append(doc)
-                
-                if not context:
-                    logger.warning("No valid context extracted")
-                    response_text = "Hi! 👋 I'm your bakery assistant. I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question\n2. Asking about a specific product category\n3. Or just ask me about our general offerings! I'm here to help! 😊"
-                else:
-                    logger.info("Generating AI response...")
-                    # Generate response using Gemini API
-                    model = genai.GenerativeModel('gemini-1.5-flash')
-                    prompt = f"""You are a friendly and knowledgeable customer service representative for a bakery business. Your role is to help customers with their inquiries about products, pricing, and services.
-
-Context from the bakery's product database:
-{chr(10).join(context)}
-
-Customer's question: {text}
-
-Please respond as a helpful customer service representative who:
-1. **Speaks in a warm, friendly, and conversational tone** - like you're talking to a friend
-2. **Gives SHORT, CONCISE answers** - keep responses brief and to the point
-3. **Directly answers the customer's question** using the product information available
-4. **Provides specific details** about products, prices, and features when asked
-5. **Uses natural, everyday language** - avoid overly formal or technical business jargon
-6. **Shows enthusiasm** about the products
-7. **Mention specific product names, prices, and descriptions** from the data when relevant
-8. **Be proactive** - if someone asks about one product, briefly suggest 1-2 related items
-9. **Keep responses under 3-4 sentences** unless the customer asks for detailed information
-
-**Response Style Guidelines:**
-- Start with a friendly greeting or acknowledgment
-- Use "we" and "our" to show you're representing the bakery
-- Include specific prices and product names from the data
-- Keep it brief and conversational
-- Use emojis sparingly (1-2 max per response)
-
-**Example short responses:**
-- "Hi! Yes, we have the Overload Brownie for ₹120 - it's packed with rich dark chocolate! 🍫"
-- "Our Mava Cake is ₹310 and it's one of our most popular items!"
-- "We have several brownie options starting at ₹110. Would you like me to tell you about our eggless varieties?"
-
-Remember: Keep responses short, friendly, and informative!"""
-
-                    response = model.generate_content(prompt)
-                    response_text = response.text
+            answer = answer_engine.answer(target_user_id, text, no_context_response=TELEGRAM_NO_CONTEXT_RESPONSE)
+            if answer.error:
+                raise answer.error
+            response_text = answer.text
             
             logger.info(f"Sending response to Telegram chat {chat_id}...")
             # Send response back to Telegram
-            success = bot.send_message(str(chat_id), response_text)
+            with answer.timer("send"):
+                success = bot.send_message(str(chat_id), response_text)
             if success:
                 logger.info(f"Successfully sent response to Telegram chat {chat_id}")
             else:
@@ -1504,67 +1504,11 @@ def test_telegram_message():
         
         # Process message using the same AI logic as the web chat
         try:
-            logger.info("Getting context from ChromaDB...")
-            # Get relevant context from ChromaDB
-            results = query_chroma(message_text, user_id, n_results=10)
-            
-            if not results or not results.get('documents'):
-                logger.warning("No data found in ChromaDB")
-                response_text = "Hi! I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question\n2. Asking about a specific product category\n3. Or just ask me about our general offerings! I'm here to help! 😊"
-            else:
-                logger.info(f"Found {len(results['documents'][0])} documents in ChromaDB")
-                # Extract relevant context from results
-                context = []
-                for doc, metadata in zip(results['documents'][0], results['metadatas'][0]):
-                    if doc:
-                        try:
-                            parsed_doc = json.loads(doc)
-                            parsed_doc['metadata'] = metadata
-                            context.append(json.dumps(parsed_doc, indent=2))
-                        except json.JSONDecodeError:
-                            context.append(doc)
-                
-                if not context:
-                    logger.warning("No valid context extracted")
-                    response_text = "Hi! I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question\n2. Asking about a specific product category\n3. Or just ask me about our general offerings! I'm here to help! 😊"
-                else:
-                    logger.info("Generating AI response...")
-                    # Generate response using Gemini API
-                    model = genai.GenerativeModel('gemini-1.5-flash')
-                    prompt = f"""You are a friendly and knowledgeable customer service representative for a bakery business. Your role is to help customers with their inquiries about products, pricing, and services.
-
-Context from the bakery's product database:
-{chr(10).join(context)}
-
-Customer's question: {message_text}
-
-Please respond as a helpful customer service representative who:
-1. **Speaks in a warm, friendly, and conversational tone** - like you're talking to a friend
-2. **Gives SHORT, CONCISE answers** - keep responses brief and to the point
-3. **Directly answers the customer's question** using the product information available
-4. **Provides specific details** about products, prices, and features when asked
-5. **Uses natural, everyday language** - avoid overly formal or technical business jargon
-6. **Shows enthusiasm** about the products
-7. **Mention specific product names, prices, and descriptions** from the data when relevant
-8. **Be proactive** - if someone asks about one product, briefly suggest 1-2 related items
-9. **Keep responses under 3-4 sentences** unless the customer asks for detailed information
-
-**Response Style Guidelines:**
-- Start with a friendly greeting or acknowledgment
-- Use "we" and "our" to show you're representing the bakery
-- Include specific prices and product names from the data
-- Keep it brief and conversational
-- Use emojis sparingly (1-2 max per response)
-
-**Example short responses:**
-- "Hi! Yes, we have the Overload Brownie for ₹120 - it's packed with rich dark chocolate! 🍫"
-- "Our Mava Cake is ₹310 and it's one of our most popular items!"
-- "We have several brownie options starting at ₹110. Would you like me to tell you about our eggless varieties?"
-
-Remember: Keep responses short, friendly, and informative!"""
-
-                    response = model.generate_content(prompt)
-                    response_text = response.text
+            # Always run the full pipeline here, so the test exercises retrieval and generation
+            answer = answer_engine.answer(user_id, message_text, no_context_response=TEST_NO_CONTEXT_RESPONSE, use_cache=False)
+            if answer.error:
+                raise answer.error
+            response_text = answer.text
             
             logger.info(f"Generated response: {response_text[:100]}...")
             
@@ -1615,6 +1559,9 @@ def telegram_poll():
                 new_messages = []
                 
                 if updates.get('ok') and updates.get('result'):
+                    # Collect every new text message first so they can all be
+                    # retrieved in a single round
+                    pending = []
                     for update in updates['result']:
                         if 'message' in update:
                             message = update['message']
@@ -1631,87 +1578,45 @@ def telegram_poll():
                                 processed_message_ids.add(message_id)
                                 continue
                             
-                            logger.info(f"Processing NEW message {message_id}: {text[:50]}...")
+                            pending.append((message_id, chat_id, text))
+                    
+                    # Answer every new message together: one retrieval round for all of them
+                    answers = answer_engine.answer_many(
+                        user_id, [text for _, _, text in pending], no_context_response=TELEGRAM_NO_CONTEXT_RESPONSE
+                    )
+                    
+                    for (message_id, chat_id, text), answer in zip(pending, answers):
+                        logger.info(f"Processing NEW message {message_id}: {text[:50]}...")
+                        
+                        # Process the message using the same logic as webhook
+                        try:
+                            if answer.error:
+                                raise answer.error
+                            response_text = answer.text
+                            if answer.source == "cache":
+                                logger.info(f"Answer cache hit for message {message_id}")
                             
-                            # Process the message using the same logic as webhook
-                            try:
-                                # Get relevant context from ChromaDB
-                                results = query_chroma(text, user_id, n_results=10)
-                                
-                                if not results or not results.get('documents'):
-                                    response_text = "Hi! 👋 I'm your bakery assistant. I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question\n2. Asking about a specific product category\n3. Or just ask me about our general offerings! I'm here to help! 😊"
-                                else:
-                                    # Extract relevant context from results
-                                    context = []
-                                    for doc, metadata in zip(results['documents'][0], results['metadatas'][0]):
-                                        if doc:
-                                            try:
-                                                parsed_doc = json.loads(doc)
-                                                parsed_doc['metadata'] = metadata
-                                                context.append(json.dumps(parsed_doc, indent=2))
-                                            except json.JSONDecodeError:
-                                                context.append(doc)
-                                        
-                                    if not context:
-                                        response_text = "Hi! 👋 I'm your bakery assistant. I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question\n2. Asking about a specific product category\n3. Or just ask me about our general offerings! I'm here to help! 😊"
-                                    else:
-                                        # Generate response using Gemini API
-                                        model = genai.GenerativeModel('gemini-1.5-flash')
-                                        prompt = f"""You are a friendly and knowledgeable customer service representative for a bakery business. Your role is to help customers with their inquiries about products, pricing, and services.
-
-Context from the bakery's product database:
-{chr(10).join(context)}
-
-Customer's question: {text}
-
-Please respond as a helpful customer service representative who:
-1. **Speaks in a warm, friendly, and conversational tone** - like you're talking to a friend
-2. **Gives SHORT, CONCISE answers** - keep responses brief and to the point
-3. **Directly answers the customer's question** using the product information available
-4. **Provides specific details** about products, prices, and features when asked
-5. **Uses natural, everyday language** - avoid overly formal or technical business jargon
-6. **Shows enthusiasm** about the products
-7. **Mention specific product names, prices, and descriptions** from the data when relevant
-8. **Be proactive** - if someone asks about one product, briefly suggest 1-2 related items
-9. **Keep responses under 3-4 sentences** unless the customer asks for detailed information
-
-**Response Style Guidelines:**
-- Start with a friendly greeting or acknowledgment
-- Use "we" and "our" to show you're representing the bakery
-- Include specific prices and product names from the data
-- Keep it brief and conversational
-- Use emojis sparingly (1-2 max per response)
-
-**Example short responses:**
-- "Hi! Yes, we have the Overload Brownie for ₹120 - it's packed with rich dark chocolate! 🍫"
-- "Our Mava Cake is ₹310 and it's one of our most popular items!"
-- "We have several brownie options starting at ₹110. Would you like me to tell you about our eggless varieties?"
-
-Remember: Keep responses short, friendly, and informative!"""
-
-                                        response = model.generate_content(prompt)
-                                        response_text = response.text
-                                
-                                # Send response back to Telegram
+                            # Send response back to Telegram
+                            with answer.timer("send"):
                                 success = bot.send_message(str(chat_id), response_text)
-                                if success:
-                                    new_messages.append({
-                                        "message_id": message_id,
-                                        "chat_id": chat_id,
-                                        "question": text,
-                                        "response": response_text[:100] + "..."
-                                    })
-                                    logger.info(f"Successfully responded to NEW message {message_id} from chat {chat_id}")
-                                else:
-                                    logger.error(f"Failed to send response to chat {chat_id}")
-                                    
-                            except Exception as e:
-                                logger.error(f"Error processing message {message_id}: {str(e)}")
-                                error_message = "Sorry, I'm having some technical difficulties right now. Please try again later! 😊"
-                                bot.send_message(str(chat_id), error_message)
-                            
-                            # Mark this message as processed
-                            processed_message_ids.add(message_id)
+                            if success:
+                                new_messages.append({
+                                    "message_id": message_id,
+                                    "chat_id": chat_id,
+                                    "question": text,
+                                    "response": response_text[:100] + "..."
+                                })
+                                logger.info(f"Successfully responded to NEW message {message_id} from chat {chat_id}")
+                            else:
+                                logger.error(f"Failed to send response to chat {chat_id}")
+                                
+                        except Exception as e:
+                            logger.error(f"Error processing message {message_id}: {str(e)}")
+                            error_message = "Sorry, I'm having some technical difficulties right now. Please try again later! 😊"
+                            bot.send_message(str(chat_id), error_message)
+                        
+                        # Mark this message as processed
+                        processed_message_ids.add(message_id)
                 
                 return jsonify({
                     "success": True,
@@ -1905,6 +1810,9 @@ def auto_poll_telegram():
                 new_messages = []
                 
                 if updates.get('ok') and updates.get('result'):
+                    # Collect every new text message first so they can all be
+                    # retrieved in a single round
+                    pending = []
                     for update in updates['result']:
                         if 'message' in update:
                             message = update['message']
@@ -1921,87 +1829,45 @@ def auto_poll_telegram():
                                 processed_message_ids.add(message_id)
                                 continue
                             
-                            logger.info(f"Processing NEW message {message_id}: {text[:50]}...")
+                            pending.append((message_id, chat_id, text))
+                    
+                    # Answer every new message together: one retrieval round for all of them
+                    answers = answer_engine.answer_many(
+                        user_id, [text for _, _, text in pending], no_context_response=TELEGRAM_NO_CONTEXT_RESPONSE
+                    )
+                    
+                    for (message_id, chat_id, text), answer in zip(pending, answers):
+                        logger.info(f"Processing NEW message {message_id}: {text[:50]}...")
+                        
+                        # Process the message using AI
+                        try:
+                            if answer.error:
+                                raise answer.error
+                            response_text = answer.text
+                            if answer.source == "cache":
+                                logger.info(f"Answer cache hit for message {message_id}")
                             
-                            # Process the message using AI
-                            try:
-                                # Get relevant context from ChromaDB
-                                results = query_chroma(text, user_id, n_results=10)
-                                
-                                if not results or not results.get('documents'):
-                                    response_text = "Hi! 👋 I'm your bakery assistant. I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question\n2. Asking about a specific product category\n3. Or just ask me about our general offerings! I'm here to help! 😊"
-                                else:
-                                    # Extract relevant context from results
-                                    context = []
-                                    for doc, metadata in zip(results['documents'][0], results['metadatas'][0]):
-                                        if doc:
-                                            try:
-                                                parsed_doc = json.loads(doc)
-                                                parsed_doc['metadata'] = metadata
-                                                context.append(json.dumps(parsed_doc, indent=2))
-                                            except json.JSONDecodeError:
-                                                context.append(doc)
-                                        
-                                    if not context:
-                                        response_text = "Hi! 👋 I'm your bakery assistant. I'm having trouble finding specific information about that. Could you try:\n\n1. Rephrasing your question\n2. Asking about a specific product category\n3. Or just ask me about our general offerings! I'm here to help! 😊"
-                                    else:
-                                        # Generate response using Gemini API
-                                        model = genai.GenerativeModel('gemini-1.5-flash')
-                                        prompt = f"""You are a friendly and knowledgeable customer service representative for a bakery business. Your role is to help customers with their inquiries about products, pricing, and services.
-
-Context from the bakery's product database:
-{chr(10).join(context)}
-
-Customer's question: {text}
-
-Please respond as a helpful customer service representative who:
-1. **Speaks in a warm, friendly, and conversational tone** - like you're talking to a friend
-2. **Gives SHORT, CONCISE answers** - keep responses brief and to the point
-3. **Directly answers the customer's question** using the product information available
-4. **Provides specific details** about products, prices, and features when asked
-5. **Uses natural, everyday language** - avoid overly formal or technical business jargon
-6. **Shows enthusiasm** about the products
-7. **Mention specific product names, prices, and descriptions** from the data when relevant
-8. **Be proactive** - if someone asks about one product, briefly suggest 1-2 related items
-9. **Keep responses under 3-4 sentences** unless the customer asks for detailed information
-
-**Response Style Guidelines:**
-- Start with a friendly greeting or acknowledgment
-- Use "we" and "our" to show you're representing the bakery
-- Include specific prices and product names from the data
-- Keep it brief and conversational
-- Use emojis sparingly (1-2 max per response)
-
-**Example short responses:**
-- "Hi! Yes, we have the Overload Brownie for ₹120 - it's packed with rich dark chocolate! 🍫"
-- "Our Mava Cake is ₹310 and it's one of our most popular items!"
-- "We have several brownie options starting at ₹110. Would you like me to tell you about our eggless varieties?"
-
-Remember: Keep responses short, friendly, and informative!"""
-
-                                        response = model.generate_content(prompt)
-                                        response_text = response.text
-                                
-                                # Send response back to Telegram
+                            # Send response back to Telegram
+                            with answer.timer("send"):
                                 success = bot.send_message(str(chat_id), response_text)
-                                if success:
-                                    new_messages.append({
-                                        "message_id": message_id,
-                                        "chat_id": chat_id,
-                                        "question": text,
-                                        "response": response_text[:100] + "..."
-                                    })
-                                    logger.info(f"Successfully responded to NEW message {message_id} from chat {chat_id}")
-                                else:
-                                    logger.error(f"Failed to send response to chat {chat_id}")
-                                    
-                            except Exception as e:
-                                logger.error(f"Error processing message {message_id}: {str(e)}")
-                                error_message = "Sorry, I'm having some technical difficulties right now. Please try again later! 😊"
-                                bot.send_message(str(chat_id), error_message)
-                            
-                            # Mark this message as processed
-                            processed_message_ids.add(message_id)
+                            if success:
+                                new_messages.append({
+                                    "message_id": message_id,
+                                    "chat_id": chat_id,
+                                    "question": text,
+                                    "response": response_text[:100] + "..."
+                                })
+                                logger.info(f"Successfully responded to NEW message {message_id} from chat {chat_id}")
+                            else:
+                                logger.error(f"Failed to send response to chat {chat_id}")
+                                
+                        except Exception as e:
+                            logger.error(f"Error processing message {message_id}: {str(e)}")
+                            error_message = "Sorry, I'm having some technical difficulties right now. Please try again later! 😊"
+                            bot.send_message(str(chat_id), error_message)
+                        
+                        # Mark this message as processed
+                        processed_message_ids.add(message_id)
                 
                 return jsonify({
                     "success": True,
@@ -2030,4 +1896,4 @@ if __name__ == '__main__':
     logger.info("🌐 Frontend should connect to: http://localhost:5000")
     logger.info("📖 API Documentation available at: http://localhost:5000")
     
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    app.run(debug=os.environ.get("FLASK_DEBUG", "True").lower() == "true", host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the vector index options on a synthetic catalog.
+
+Compares recall@10 (against brute-force float32 search), per-query
+latency and bytes per item for ChromaDB's HNSW collection and the exact
+index stored as float32, float16 and int8, plus end-to-end query_chroma
+latency per backend. Results are printed, and also written to ``output``
+if given.
+
+Usage: python bench_exact_index.py [items] [queries] [output]
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Keep the benchmark's stores away from the real ./chroma_db
+WORKDIR = tempfile.mkdtemp(prefix="bench_exact_index_")
+os.environ["CHROMA_DB_PATH"] = WORKDIR
+os.environ["RESULT_CACHE_SIZE"] = "0"
+
+import logging
+import numpy as np
+import chroma_utils
+import exact_index
+from exact_index import ExactIndex
+
+logging.disable(logging.INFO)
+
+K = 10
+
+def make_catalog(count, rng):
+    syllables = ["ka", "lo", "mi", "ra", "chi", "no", "ve", "ta", "su", "pe", "bu", "dor", "lin", "mas", "tor"]
+    words = sorted({"".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(4000)})
+    items = []
+    for i in range(count):
+        items.append({
+            "name": f"{rng.choice(words).title()} {rng.choice(words).title()}",
+            "price": f"₹{rng.randint(50, 5000)}",
+            "description": " ".join(rng.choice(words) for _ in range(rng.randint(15, 40))),
+            "sku": f"SKU-{i:05d}"
+        })
+    return items, words
+
+def make_queries(items, words, count, rng):
+    queries = []
+    for _ in range(count):
+        item = rng.choice(items)
+        terms = rng.sample(item["description"].split(), 4) + [rng.choice(words)]
+        queries.append(" ".join(terms))
+    return queries
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+def recall(predicted, truth):
+    return np.mean([len(set(p) & set(t)) / max(len(t), 1) for p, t in zip(predicted, truth)])
+
+def timed(search, queries):
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return results, float(np.mean(latencies)), float(np.percentile(latencies, 95))
+
+def main():
+    try:
+        return run()
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+def run():
+    item_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rng = random.Random(7)
+    items, words = make_catalog(item_count, rng)
+    queries = make_queries(items, words, query_count, rng)
+    lines = [f"Catalog: {item_count} items, {query_count} queries, recall@{K} vs brute-force float32", ""]
+
+    # A ChromaDB tenant, as query_chroma sees it today
+    chroma_utils.EXACT_INDEX_MAX_ITEMS = 0
+    chroma_utils.store_data_in_chroma(items, "bench_chroma")
+    embedder = chroma_utils.get_user_embedder("bench_chroma")
+    collection = chroma_utils.get_user_collection("bench_chroma")
+    stored = collection.get(include=["documents", "metadatas", "embeddings"])
+    ids, documents, metadatas = stored["ids"], stored["documents"], stored["metadatas"]
+    vectors = np.asarray(stored["embeddings"], dtype=np.float32)
+    query_vectors = embedder.transform(queries)
+
+    baseline = ExactIndex(ids, documents, metadatas, vectors, quantization="none")
+    truth = [[ids[i] for i in row] for row in baseline.top_k(query_vectors, K)[0]]
+
+    header = f"{'index':<28}{'recall@10':>10}{'mean ms':>10}{'p95 ms':>10}{'scan B/item':>13}{'disk B/item':>13}"
+    lines += [header, "-" * len(header)]
+
+    hits, mean, p95 = timed(
+        lambda q: collection.query(query_embeddings=[q], n_results=K)["ids"][0], query_vectors
+    )
+    chroma_disk = dir_size(chroma_utils.shard_map.shard_path(0)) - dir_size(chroma_utils.get_tenant_dir("bench_chroma"))
+    lines.append(f"{'chroma hnsw (float32)':<28}{recall(hits, truth):>10.3f}{mean:>10.3f}{p95:>10.3f}"
+                 f"{vectors.nbytes / item_count:>13.0f}{chroma_disk / item_count:>13.0f}")
+
+    for quantization, rerank in [("none", 0), ("float16", 0), ("float16", 4), ("int8", 0), ("int8", 4)]:
+        index = ExactIndex(ids, documents, metadatas, vectors, quantization=quantization, rerank=rerank)
+        target = os.path.join(WORKDIR, f"exact_{quantization}_{rerank}")
+        index.save(target)
+        index = ExactIndex.load(target) if quantization == "none" else index
+        hits, mean, p95 = timed(lambda q: [ids[i] for i in index.top_k(q[None, :], K)[0][0]], query_vectors)
+        name = f"exact {quantization}" + (f" rerank x{rerank}" if rerank else "")
+        lines.append(f"{name:<28}{recall(hits, truth):>10.3f}{mean:>10.3f}{p95:>10.3f}"
+                     f"{index.nbytes / item_count:>13.0f}{dir_size(target) / item_count:>13.0f}")
+
+    # End to end, including embedding, BM25 and fusion
+    lines += ["", f"{'query_chroma backend':<28}{'mean ms':>10}{'p95 ms':>10}", "-" * 48]
+    chroma_utils.EXACT_INDEX_MAX_ITEMS = item_count
+    for quantization in ["none", "int8"]:
+        exact_index.EXACT_INDEX_QUANTIZATION = quantization
+        chroma_utils.store_data_in_chroma(items, f"bench_exact_{quantization}")
+    for name, user_id in [("chroma", "bench_chroma"), ("exact float32", "bench_exact_none"),
+                          ("exact int8", "bench_exact_int8")]:
+        chroma_utils.query_chroma(queries[0], user_id, n_results=K)
+        _, mean, p95 = timed(lambda q: chroma_utils.query_chroma(q, user_id, n_results=K), queries)
+        lines.append(f"{name:<28}{mean:>10.3f}{p95:>10.3f}")
+
+    output = "\n".join(lines)
+    print(output)
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
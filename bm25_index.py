@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import re
+import numpy as np
+from embedding_utils import fold_plural
+
+logger = logging.getLogger(__name__)
+
+BM25_FILENAME = "bm25.json"
+
+# Bumped whenever tokenize changes, so indexes built by an older version are rebuilt
+TOKENIZER_VERSION = 2
+
+# Lexical tokens keep numbers so SKUs and sizes ("500g") can be matched
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+def tokenize(text):
+    """Lower-cased word tokens, plurals folded, used for both indexing and querying."""
+    return [fold_plural(token) for token in TOKEN_PATTERN.findall(text.lower())]
+
+class BM25Index:
+    """In-process BM25 inverted index over one tenant's documents.
+
+    Per-posting BM25 weights are precomputed at build time, so a search
+    is just a few array scatter-adds over the postings of the query terms.
+    """
+
+    def __init__(self, ids, postings, content_types=None):
+        self.ids = list(ids)
+        self.content_types = list(content_types) if content_types else [None] * len(self.ids)
+        self._type_arrays = {}
+        self.postings = {
+            term: (np.asarray(docs, dtype=np.int32), np.asarray(weights, dtype=np.float32))
+            for term, (docs, weights) in postings.items()
+        }
+        # Best weight of every term, for normalising scores
+        self.max_weights = {
+            term: float(weights.max()) for term, (_, weights) in self.postings.items() if len(weights)
+        }
+
+    @classmethod
+    def build(cls, ids, texts, content_types=None, k1=1.5, b=0.75):
+        """Build an index from parallel lists of IDs, texts and content types."""
+        term_counts = []
+        doc_freq = {}
+        for text in texts:
+            counts = {}
+            for token in tokenize(text):
+                counts[token] = counts.get(token, 0) + 1
+            term_counts.append(counts)
+            for token in counts:
+                doc_freq[token] = doc_freq.get(token, 0) + 1
+
+        doc_count = len(texts)
+        lengths = [sum(counts.values()) for counts in term_counts]
+        avg_length = (sum(lengths) / doc_count) if doc_count else 0.0
+        idf = {
+            term: float(np.log(1 + (doc_count - df + 0.5) / (df + 0.5)))
+            for term, df in doc_freq.items()
+        }
+
+        postings = {}
+        for doc_index, counts in enumerate(term_counts):
+            norm = k1 * (1 - b + b * lengths[doc_index] / avg_length) if avg_length else k1
+            for term, tf in counts.items():
+                weight = idf[term] * tf * (k1 + 1) / (tf + norm)
+                docs, weights = postings.setdefault(term, ([], []))
+                docs.append(doc_index)
+                weights.append(weight)
+        return cls(ids, postings, content_types)
+
+    def _type_mask(self, content_types):
+        key = tuple(sorted(content_types))
+        mask = self._type_arrays.get(key)
+        if mask is None:
+            allowed = set(content_types)
+            mask = np.array([t in allowed for t in self.content_types], dtype=bool)
+            self._type_arrays[key] = mask
+        return mask
+
+    def search(self, query_text, top_k=10, content_types=None):
+        """Return up to ``top_k`` (id, score) pairs with a positive score.
+
+        If ``content_types`` is given, only documents of those types match.
+        """
+        terms = set(tokenize(query_text))
+        if not terms or not self.ids:
+            return []
+
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        if content_types:
+            scores[~self._type_mask(content_types)] = 0.0
+
+        top_k = min(top_k, len(self.ids))
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(self.ids[i], float(scores[i])) for i in candidates if scores[i] > 0]
+
+    def score_bound(self, query_text):
+        """Highest score any document could get for the query.
+
+        Dividing a search score by this maps it into [0, 1], comparable
+        across queries.
+        """
+        return sum(self.max_weights.get(term, 0.0) for term in set(tokenize(query_text)))
+
+    def save(self, path):
+        """Persist the index as JSON next to the tenant's collection."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "tokenizer": TOKENIZER_VERSION,
+                "ids": self.ids,
+                "content_types": self.content_types,
+                "postings": {
+                    term: [docs.tolist(), np.round(weights, 5).tolist()]
+                    for term, (docs, weights) in self.postings.items()
+                }
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a persisted index, or return None if there is none.
+
+        Indexes built with an older tokenizer also give None, since their
+        terms would not match today's query tokens.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("tokenizer") != TOKENIZER_VERSION:
+            logger.info(f"BM25 index at {path} predates tokenizer version {TOKENIZER_VERSION}")
+            return None
+        return cls(state["ids"], state["postings"], state.get("content_types"))
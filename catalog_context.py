@@ -0,0 +1,104 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from chroma_utils import get_user_catalog, get_user_collection_name, register_tenant_cache, touch_user
+from context_packer import estimate_tokens, render_item
+
+logger = logging.getLogger(__name__)
+
+# Tenants whose whole catalog renders within this many tokens skip retrieval
+# and get the full catalog as context (0 disables)
+CATALOG_TOKEN_BUDGET = int(os.getenv("CATALOG_TOKEN_BUDGET", "3000"))
+
+# Maximum number of tenants whose catalog block (or lack of one) is cached
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "1000"))
+
+# No rendered item is shorter than this, so catalogs with more entries than
+# budget / _MIN_ITEM_TOKENS cannot fit and are never read
+_MIN_ITEM_TOKENS = 8
+
+def render_catalog(documents, metadatas, budget):
+    """Render a whole catalog as context lines, or None if it exceeds ``budget``.
+
+    Items use their context card when they have one and are grouped by
+    content type. Returns ``(context, tokens, items)``.
+    """
+    lines = set()
+    for document, metadata in zip(documents, metadatas):
+        line = (metadata or {}).get('context_card') or render_item(document, metadata)
+        if line:
+            lines.add(line)
+    ordered = sorted(lines)
+    context = "\n".join(ordered)
+    tokens = estimate_tokens(context) + len(ordered)
+    if tokens > budget:
+        return None
+    return context, tokens, len(ordered)
+
+class CatalogContext:
+    """Full-catalog prompt context for tenants small enough to send whole.
+
+    Whether a tenant's catalog fits CATALOG_TOKEN_BUDGET, and the
+    rendered block if it does, is worked out once per corpus generation,
+    so it is rebuilt only after the tenant re-ingests. Cached blocks count
+    towards the tenant memory budget and go when their tenant is
+    unloaded; the least recently used tenants are also forgotten beyond
+    ``max_entries``.
+    """
+
+    def __init__(self, budget=CATALOG_TOKEN_BUDGET, max_entries=CATALOG_CACHE_SIZE):
+        self.budget = budget
+        self.max_entries = max_entries
+        # collection name -> (generation, (context, tokens, items) or None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        register_tenant_cache(self._size_of, self._unload)
+
+    def get(self, user_id, generation):
+        """The tenant's catalog block as ``(context, tokens, items)``, or None if it does not fit."""
+        if self.budget <= 0:
+            return None
+        collection_name = get_user_collection_name(user_id)
+        with self._lock:
+            entry = self._entries.get(collection_name)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(collection_name)
+                block = entry[1]
+            else:
+                entry = None
+        if entry is not None:
+            # Tenants that do not fit are recorded by retrieval instead
+            if block is not None:
+                touch_user(user_id)
+            return block
+
+        block = None
+        catalog = get_user_catalog(user_id, max_entries=self.budget // _MIN_ITEM_TOKENS)
+        if catalog is not None:
+            block = render_catalog(catalog[0], catalog[1], self.budget)
+        if block is not None:
+            logger.info(f"Catalog for user {user_id} fits the prompt: {block[2]} items, ~{block[1]} tokens")
+
+        with self._lock:
+            self._entries[collection_name] = (generation, block)
+            self._entries.move_to_end(collection_name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if block is not None:
+            touch_user(user_id, resized=True)
+        return block
+
+    def invalidate(self, user_id):
+        """Forget a tenant's catalog block."""
+        self._unload(get_user_collection_name(user_id))
+
+    def _size_of(self, collection_name):
+        entry = self._entries.get(collection_name)
+        if entry is None or entry[1] is None:
+            return 0
+        return 2 * len(entry[1][0]) + 200
+
+    def _unload(self, collection_name):
+        with self._lock:
+            self._entries.pop(collection_name, None)
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Tenant sharding across independent ChromaDB persistent stores.
+
+Each shard is its own persistent store (and so its own SQLite file), so
+ingest for a tenant on one shard does not block readers and writers on
+the others. Tenants are placed by consistent hashing; after changing
+CHROMA_SHARDS, run ``python chroma_shards.py rebalance`` (with the app
+stopped) to move tenants to their new shards.
+
+With VECTOR_BACKEND=embedded (the default) every app process opens the
+stores itself. With VECTOR_BACKEND=http the stores are served by one
+ChromaDB server per shard, started with ``python chroma_shards.py serve``,
+so several app workers share a single copy of each index. The in-process
+exact index is not used in that mode (see EXACT_INDEX_MAX_ITEMS), so
+small tenants are served by the shared servers too. Each worker still
+loads its own copy of a tenant's embedder and BM25 index.
+"""
+
+import argparse
+import bisect
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import chromadb
+from chromadb.config import Settings
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+CHROMA_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db")
+
+# Number of persistent stores tenants are spread over
+CHROMA_SHARDS = int(os.getenv("CHROMA_SHARDS", "1"))
+
+# "embedded" opens the stores in-process, "http" talks to `serve`d stores
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "embedded").lower()
+
+# Address of shard 0's server in http mode; shard N listens on CHROMA_PORT + N
+CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+
+# Pooled HTTP connections per shard client, shared by all request threads
+CHROMA_HTTP_POOL_SIZE = int(os.getenv("CHROMA_HTTP_POOL_SIZE", "32"))
+
+# Memory each embedded shard may spend on loaded HNSW segments before it
+# unloads the least recently used ones (0 keeps ChromaDB's unbounded default).
+# The app derives it from TENANT_MEMORY_BUDGET_MB when unset; see chroma_utils
+CHROMA_SEGMENT_CACHE_MB = int(os.getenv("CHROMA_SEGMENT_CACHE_MB") or "0")
+
+# Points per shard on the hash ring; more points give a more even spread
+SHARD_VIRTUAL_NODES = 64
+
+SHARDS_DIRNAME = "shards"
+TENANTS_DIRNAME = "tenants"
+
+# Suffixes of the temporary collections a full re-embed builds and retires
+SHADOW_SUFFIXES = (".next", ".retired")
+
+def _ring_hash(key):
+    return int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:16], 16)
+
+def _http_settings(pool_size):
+    try:
+        return Settings(
+            anonymized_telemetry=False,
+            chroma_http_max_connections=pool_size,
+            chroma_http_max_keepalive_connections=pool_size
+        )
+    except Exception:
+        # Older ChromaDB releases have no pool settings
+        return Settings(anonymized_telemetry=False)
+
+def _collection_names(client):
+    # list_collections() returns names on newer ChromaDB, objects on older
+    return {getattr(collection, "name", collection) for collection in client.list_collections()}
+
+class ShardMap:
+    """Consistent-hash placement of tenant collections onto shards.
+
+    Shard 0 is the original single store at ``root``, so a one-shard
+    setup keeps the existing layout. A tenant whose data sits on another
+    shard than the one it hashes to (because the shard count changed and
+    no rebalance has run yet) is still found where its data is.
+    """
+
+    def __init__(self, root=CHROMA_PATH, shard_count=CHROMA_SHARDS, virtual_nodes=SHARD_VIRTUAL_NODES,
+                 backend=VECTOR_BACKEND, host=CHROMA_HOST, port=CHROMA_PORT,
+                 segment_cache_mb=CHROMA_SEGMENT_CACHE_MB):
+        if backend not in ("embedded", "http"):
+            raise ValueError(f"Unknown VECTOR_BACKEND: {backend}")
+        self.root = root
+        self.shard_count = max(1, shard_count)
+        self.backend = backend
+        self.host = host
+        self.port = port
+        self.segment_cache_mb = segment_cache_mb
+        ring = sorted(
+            (_ring_hash(f"shard_{shard}#{node}"), shard)
+            for shard in range(self.shard_count)
+            for node in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [shard for _, shard in ring]
+        self._clients = {}
+        self._placements = {}
+        self._lock = threading.Lock()
+
+    def shard_path(self, shard):
+        """Directory of a shard's persistent store."""
+        if shard == 0:
+            return self.root
+        return os.path.join(self.root, SHARDS_DIRNAME, f"shard_{shard}")
+
+    def tenant_dir(self, collection_name, shard):
+        """A tenant's retrieval files on a given shard."""
+        return os.path.join(self.shard_path(shard), TENANTS_DIRNAME, collection_name)
+
+    def hashed_shard(self, collection_name):
+        """Shard a tenant belongs on according to the ring."""
+        index = bisect.bisect(self._points, _ring_hash(collection_name)) % len(self._points)
+        return self._owners[index]
+
+    def existing_shards(self):
+        """Shards with a store on disk, including ones beyond the current count."""
+        shards = {0}
+        shards_root = os.path.join(self.root, SHARDS_DIRNAME)
+        if os.path.isdir(shards_root):
+            for name in os.listdir(shards_root):
+                if name.startswith("shard_") and name[6:].isdigit():
+                    shards.add(int(name[6:]))
+        return sorted(shards | set(range(self.shard_count)))
+
+    def shard_port(self, shard):
+        """Port a shard's server listens on in http mode."""
+        return self.port + shard
+
+    def client(self, shard):
+        """Client for a shard, created on first use and shared by all threads."""
+        with self._lock:
+            client = self._clients.get(shard)
+            if client is None:
+                if self.backend == "http":
+                    client = chromadb.HttpClient(
+                        host=self.host,
+                        port=self.shard_port(shard),
+                        settings=_http_settings(CHROMA_HTTP_POOL_SIZE)
+                    )
+                elif self.segment_cache_mb > 0:
+                    client = chromadb.PersistentClient(
+                        path=self.shard_path(shard),
+                        settings=Settings(
+                            chroma_segment_cache_policy="LRU",
+                            chroma_memory_limit_bytes=self.segment_cache_mb * 1024 * 1024
+                        )
+                    )
+                else:
+                    client = chromadb.PersistentClient(path=self.shard_path(shard))
+                self._clients[shard] = client
+            return client
+
+    def segment_cache_bytes(self):
+        """Most memory this process's shard clients spend on HNSW segments (0 if unbounded or remote)."""
+        if self.backend != "embedded":
+            return 0
+        return self.segment_cache_mb * 1024 * 1024 * self.shard_count
+
+    def _has_collection(self, shard, collection_name):
+        if self.backend == "embedded" and shard != 0 and not os.path.isdir(self.shard_path(shard)):
+            return False
+        try:
+            return collection_name in _collection_names(self.client(shard))
+        except Exception:
+            return False
+
+    def shard_for(self, collection_name):
+        """Shard holding a tenant's data, or the one it hashes to if it has none."""
+        shard = self._placements.get(collection_name)
+        if shard is not None:
+            return shard
+
+        target = self.hashed_shard(collection_name)
+        shard = target
+        if not os.path.isdir(self.tenant_dir(collection_name, target)):
+            others = [other for other in self.existing_shards() if other != target]
+            # Tenant files are the cheap check; collections cover tenants
+            # stored before tenant files existed
+            found = next((other for other in others if os.path.isdir(self.tenant_dir(collection_name, other))), None)
+            if found is None and not self._has_collection(target, collection_name):
+                found = next((other for other in others if self._has_collection(other, collection_name)), None)
+            if found is not None:
+                shard = found
+        with self._lock:
+            self._placements[collection_name] = shard
+        return shard
+
+    def forget(self, collection_name):
+        """Drop a tenant's cached placement, e.g. after deleting its data."""
+        with self._lock:
+            self._placements.pop(collection_name, None)
+
+    def tenants(self):
+        """Map of every stored tenant to the shard its data is on."""
+        located = {}
+        for shard in self.existing_shards():
+            tenants_root = os.path.join(self.shard_path(shard), TENANTS_DIRNAME)
+            if os.path.isdir(tenants_root):
+                for name in os.listdir(tenants_root):
+                    located.setdefault(name, shard)
+            if self.backend == "http" or shard == 0 or os.path.isdir(self.shard_path(shard)):
+                try:
+                    for name in _collection_names(self.client(shard)):
+                        if not name.endswith(SHADOW_SUFFIXES):
+                            located.setdefault(name, shard)
+                except Exception as e:
+                    logger.error(f"Failed to list collections on shard {shard}: {str(e)}")
+        return located
+
+    def misplaced(self):
+        """(collection, current shard, target shard) for tenants off their hashed shard."""
+        return [
+            (name, shard, self.hashed_shard(name))
+            for name, shard in sorted(self.tenants().items())
+            if shard != self.hashed_shard(name)
+        ]
+
+    def migrate(self, collection_name, source, target, batch_size=500):
+        """Move one tenant's collection and files from one shard to another.
+
+        Stored vectors are copied as they are, so nothing is re-embedded.
+        The source copy is only removed once the target copy is complete.
+        """
+        source_client = self.client(source)
+        target_client = self.client(target)
+        if collection_name in _collection_names(source_client):
+            source_collection = source_client.get_collection(collection_name)
+            if collection_name in _collection_names(target_client):
+                target_client.delete_collection(collection_name)
+            target_collection = target_client.create_collection(
+                name=collection_name,
+                metadata=source_collection.metadata
+            )
+            total = source_collection.count()
+            for offset in range(0, total, batch_size):
+                page = source_collection.get(
+                    limit=batch_size,
+                    offset=offset,
+                    include=["embeddings", "documents", "metadatas"]
+                )
+                target_collection.add(
+                    ids=page["ids"],
+                    embeddings=page["embeddings"],
+                    documents=page["documents"],
+                    metadatas=page["metadatas"]
+                )
+            if target_collection.count() != total:
+                raise RuntimeError(f"Copied {target_collection.count()} of {total} items for {collection_name}")
+
+        source_dir = self.tenant_dir(collection_name, source)
+        if os.path.isdir(source_dir):
+            target_dir = self.tenant_dir(collection_name, target)
+            shutil.rmtree(target_dir, ignore_errors=True)
+            shutil.copytree(source_dir, target_dir)
+
+        if collection_name in _collection_names(source_client):
+            source_client.delete_collection(collection_name)
+        shutil.rmtree(source_dir, ignore_errors=True)
+        with self._lock:
+            self._placements[collection_name] = target
+        logger.info(f"Moved {collection_name} from shard {source} to shard {target}")
+
+    def rebalance(self, dry_run=False, batch_size=500):
+        """Move every misplaced tenant to its hashed shard; returns the moves."""
+        moves = self.misplaced()
+        if not dry_run:
+            for name, source, target in moves:
+                self.migrate(name, source, target, batch_size=batch_size)
+        return moves
+
+    def serve(self):
+        """Run one ChromaDB server per shard until interrupted."""
+        processes = []
+        for shard in range(self.shard_count):
+            os.makedirs(self.shard_path(shard), exist_ok=True)
+            command = ["chroma", "run", "--path", self.shard_path(shard),
+                       "--host", self.host, "--port", str(self.shard_port(shard))]
+            logger.info(f"Serving shard {shard} on {self.host}:{self.shard_port(shard)}")
+            processes.append(subprocess.Popen(command))
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.terminate()
+        return all(process.returncode in (0, None, -15) for process in processes)
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and rebalance tenant shards")
+    parser.add_argument("command", choices=["status", "rebalance", "migrate", "serve"])
+    parser.add_argument("collection", nargs="?", help="Collection to migrate (migrate only)")
+    parser.add_argument("--to", type=int, help="Target shard (migrate only)")
+    parser.add_argument("--shards", type=int, default=CHROMA_SHARDS, help="Shard count (default: CHROMA_SHARDS)")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the planned moves")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "serve":
+        return ShardMap(CHROMA_PATH, args.shards, backend="http").serve()
+
+    shard_map = ShardMap(CHROMA_PATH, args.shards)
+
+    if args.command == "status":
+        counts = {}
+        for name, shard in shard_map.tenants().items():
+            counts[shard] = counts.get(shard, 0) + 1
+        for shard in shard_map.existing_shards():
+            print(f"shard {shard}: {counts.get(shard, 0)} tenants ({shard_map.shard_path(shard)})")
+        print(f"{len(shard_map.misplaced())} tenants need rebalancing")
+        return True
+
+    if args.command == "rebalance":
+        moves = shard_map.rebalance(dry_run=args.dry_run)
+        for name, source, target in moves:
+            print(f"{name}: shard {source} -> shard {target}")
+        print(f"{'Would move' if args.dry_run else 'Moved'} {len(moves)} tenants")
+        return True
+
+    if not args.collection or args.to is None:
+        parser.error("migrate needs a collection and --to")
+    source = shard_map.shard_for(args.collection)
+    if source == args.to:
+        print(f"{args.collection} is already on shard {args.to}")
+        return True
+    print(f"{args.collection}: shard {source} -> shard {args.to}")
+    if not args.dry_run:
+        shard_map.migrate(args.collection, source, args.to)
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
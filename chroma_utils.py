@@ -1,11 +1,23 @@
-import chromadb
+import hashlib
 import os
 from dotenv import load_dotenv
 import json
 import logging
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
+import shutil
+import threading
 import time
+import uuid
+from collections import OrderedDict
+from embedding_utils import TenantEmbedder, EMBEDDER_FILENAME
+from embedding_cache import EmbeddingCache
+from bm25_index import BM25Index, BM25_FILENAME, tokenize
+from exact_index import ExactIndex
+from content_types import CONTENT_TYPES, classify_item, classify_question, project_metadata
+from passage_utils import PASSAGE_MAX_CHARS, split_passages, merge_passages
+from context_packer import build_card
+from chroma_shards import ShardMap, SHADOW_SUFFIXES, CHROMA_SHARDS, VECTOR_BACKEND
+from tenant_residency import TenantResidency, TENANT_MEMORY_BUDGET_MB
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -14,10 +26,61 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Initialize ChromaDB client with persistence
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
+# Share of TENANT_MEMORY_BUDGET_MB that ChromaDB's loaded HNSW segments get,
+# split across the shards, unless CHROMA_SEGMENT_CACHE_MB sets it per shard;
+# the rest bounds the embedders, BM25 and exact indexes tracked by residency
+SEGMENT_CACHE_SHARE = 0.5
+CHROMA_SEGMENT_CACHE_MB = int(
+    os.getenv("CHROMA_SEGMENT_CACHE_MB")
+    or max(1, int(TENANT_MEMORY_BUDGET_MB * SEGMENT_CACHE_SHARE) // max(1, CHROMA_SHARDS))
+)
+
+# ChromaDB persistence, spread over CHROMA_SHARDS independent stores
+CHROMA_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db")
+shard_map = ShardMap(CHROMA_PATH, segment_cache_mb=CHROMA_SEGMENT_CACHE_MB)
+
+# Number of items written to ChromaDB per add() call during ingestion
+INGEST_BATCH_SIZE = int(os.getenv("CHROMA_INGEST_BATCH_SIZE", "500"))
+
+# Fraction of a collection that must change before the embedder is refitted
+EMBEDDER_REFIT_RATIO = float(os.getenv("EMBEDDER_REFIT_RATIO", "0.2"))
+
+# Tenants with at most this many items use the exact NumPy index instead of
+# ChromaDB. Exact indexes are held by each app process, so with
+# VECTOR_BACKEND=http they are off and every tenant uses the shared servers
+EXACT_INDEX_MAX_ITEMS = 0 if VECTOR_BACKEND == "http" else int(os.getenv("EXACT_INDEX_MAX_ITEMS", "2000"))
+
+# Neighbouring passages merged into each passage hit on either side
+PASSAGE_NEIGHBORS = int(os.getenv("PASSAGE_NEIGHBORS", "0"))
+
+# Maximum number of query results memoized across all tenants
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "2048"))
+
+# Candidates taken from each retriever before rank fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+
+ORTHOGONAL_DISTANCE = 2.0 - 1e-6
 
-# Define a fixed vocabulary for consistent dimensions
+# Reciprocal rank fusion constant; larger values flatten rank differences
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Hits below this relevance (0-1) are dropped by adaptive retrieval; tenants
+# can override it with set_user_min_relevance
+RELEVANCE_THRESHOLD = float(os.getenv("RELEVANCE_THRESHOLD", "0.05"))
+
+# Adaptive retrieval cuts the ranking at its largest relevance drop when
+# that drop is at least this fraction of the best hit's relevance
+RELEVANCE_GAP_RATIO = float(os.getenv("RELEVANCE_GAP_RATIO", "0.3"))
+
+# The gap cut never keeps fewer hits than this, leaving room for related items
+RELEVANCE_MIN_RESULTS = int(os.getenv("RELEVANCE_MIN_RESULTS", "3"))
+
+RETRIEVAL_SETTINGS_FILENAME = "retrieval.json"
+
+# Item fields that identify an item across syncs, in order of preference
+ITEM_KEY_FIELDS = ('sku', 'id', 'name', 'title', 'question', 'companyName')
+
+# Vocabulary used for collections stored before embedders were fitted per tenant
 FIXED_VOCABULARY = [
     'category', 'description', 'price', 'availability', 'imageurl',
     'name', 'brand', 'rating', 'reviews', 'specifications',
@@ -26,44 +89,754 @@ FIXED_VOCABULARY = [
     'sales', 'revenue', 'customers', 'market', 'trends'
 ]
 
-# Initialize TF-IDF vectorizer with fixed vocabulary
-vectorizer = TfidfVectorizer(
-    vocabulary=dict(zip(FIXED_VOCABULARY, range(len(FIXED_VOCABULARY)))),
-    max_features=25  # Increased to accommodate more business-related terms
-)
+legacy_embedder = TenantEmbedder.from_vocabulary(FIXED_VOCABULARY)
+
+# Embeddings already computed, keyed by content digest and embedder version
+embedding_cache = EmbeddingCache(os.path.join(CHROMA_PATH, "embedding_cache.sqlite3"))
+
+# Fitted embedders by collection name; only ingest and first load write here
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+# BM25 indexes by collection name, built at ingest and loaded lazily
+_bm25_indexes = {}
+_bm25_lock = threading.Lock()
+
+# Exact indexes by collection name; None marks a tenant stored in ChromaDB
+_exact_indexes = {}
+_exact_lock = threading.Lock()
+
+# Per-tenant retrieval settings by collection name, loaded lazily
+_retrieval_settings = {}
+
+# Caches kept outside this module that hold per-tenant state, as
+# (size_of, unload) pairs; see register_tenant_cache
+_tenant_caches = []
+
+# Bumped whenever a tenant's stored data changes; cached state tagged with
+# an older generation is never used
+_generations = {}
+
+# Change stamps shared by all app processes: every store or delete rewrites
+# the tenant's stamp, and a process that sees a stamp it did not write
+# drops its cached state for that tenant
+STAMPS_DIR = os.path.join(CHROMA_PATH, "stamps")
+_seen_stamps = {}
+
+# Seconds a process trusts its last look at a tenant's stamp, so queries do
+# not touch the disk each time; changes from other processes show up
+# within this delay
+STAMP_CHECK_SECONDS = float(os.getenv("STAMP_CHECK_SECONDS", "1.0"))
+_stamps_checked_at = {}
+
+# Collection handles by collection name, as (generation, handle)
+_collection_handles = {}
+_handles_lock = threading.Lock()
+
+# Query results by (collection, generation, query fingerprint, options)
+_result_cache = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+# Which tenants have state loaded above; idle ones are unloaded beyond what
+# TENANT_MEMORY_BUDGET_MB leaves after the segment cache, and reload on their
+# next query
+_memory_budget = TENANT_MEMORY_BUDGET_MB * 1024 * 1024
+residency = TenantResidency(budget_bytes=max(_memory_budget - shard_map.segment_cache_bytes(), _memory_budget // 4))
+
+# Last query time by collection, persisted so a restarted process can warm
+# up the tenants that were active before it stopped
+RECENT_TENANTS_PATH = os.path.join(CHROMA_PATH, "recent_tenants.json")
+RECENT_TENANTS_MAX = 1000
+_RECENT_SAVE_INTERVAL = 60
+_last_access = {}
+_recent_saved_at = 0.0
+_recent_lock = threading.Lock()
 
 def get_user_collection_name(user_id):
     """Generate a unique collection name for a user."""
     return f"user_{user_id}_data"
 
-def get_embedding(text):
-    """Generate embedding using TF-IDF vectorization with fixed dimension."""
+def get_user_client(user_id):
+    """ChromaDB client of the shard holding a user's data."""
+    return shard_map.client(shard_map.shard_for(get_user_collection_name(user_id)))
+
+def get_tenant_dir(user_id):
+    """Directory holding a user's retrieval files next to their ChromaDB shard."""
+    collection_name = get_user_collection_name(user_id)
+    return shard_map.tenant_dir(collection_name, shard_map.shard_for(collection_name))
+
+def _read_stamp(collection_name):
     try:
-        # Convert text to TF-IDF vector
-        tfidf_matrix = vectorizer.fit_transform([text])
-        # Convert to dense array
-        embedding = tfidf_matrix.toarray()[0]
-        
-        # Ensure the embedding has exactly 25 dimensions
-        if len(embedding) < 25:
-            # Pad with zeros if shorter
-            embedding = np.pad(embedding, (0, 25 - len(embedding)))
-        elif len(embedding) > 25:
-            # Truncate if longer
-            embedding = embedding[:25]
-            
-        # Normalize the embedding
-        norm = np.linalg.norm(embedding)
-        if norm > 0:
-            embedding = embedding / norm
-            
-        return embedding.tolist()
+        with open(os.path.join(STAMPS_DIR, collection_name), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def _write_stamp(collection_name):
+    stamp = uuid.uuid4().hex
+    path = os.path.join(STAMPS_DIR, collection_name)
+    try:
+        os.makedirs(STAMPS_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(stamp)
+        os.replace(tmp_path, path)
+        _seen_stamps[collection_name] = stamp
+    except OSError as e:
+        logger.error(f"Failed to write change stamp for {collection_name}: {str(e)}")
+
+def _drop_cached_state(collection_name):
+    residency.resize(collection_name)
+    with _handles_lock:
+        _generations[collection_name] = _generations.get(collection_name, 0) + 1
+        _collection_handles.pop(collection_name, None)
+    with _result_cache_lock:
+        for key in [key for key in _result_cache if key[0] == collection_name]:
+            del _result_cache[key]
+
+def _sync_user_cache(collection_name, force=False):
+    """Forget a tenant's cached state if another process changed their data.
+
+    The stamp is read at most once per STAMP_CHECK_SECONDS unless ``force``.
+    """
+    now = time.monotonic()
+    if not force and now - _stamps_checked_at.get(collection_name, -STAMP_CHECK_SECONDS) < STAMP_CHECK_SECONDS:
+        return
+    _stamps_checked_at[collection_name] = now
+    stamp = _read_stamp(collection_name)
+    if stamp == _seen_stamps.get(collection_name):
+        return
+    logger.info(f"Data for {collection_name} changed in another process, reloading")
+    with _embedders_lock:
+        _embedders.pop(collection_name, None)
+    with _bm25_lock:
+        _bm25_indexes.pop(collection_name, None)
+    with _exact_lock:
+        _exact_indexes.pop(collection_name, None)
+    _retrieval_settings.pop(collection_name, None)
+    _drop_cached_state(collection_name)
+    _seen_stamps[collection_name] = stamp
+
+def _resident_bytes(collection_name):
+    """Rough in-memory footprint of a tenant's loaded retrieval state.
+
+    ChromaDB's own HNSW segments are not included; they have their own
+    share of the budget (see SEGMENT_CACHE_SHARE).
+    """
+    size = 0
+    embedder = _embedders.get(collection_name)
+    if embedder is not None and embedder is not legacy_embedder:
+        size += embedder.idf.nbytes + 100 * len(embedder.vocabulary)
+    bm25 = _bm25_indexes.get(collection_name)
+    if bm25 is not None:
+        size += 100 * len(bm25.ids) + sum(
+            docs.nbytes + weights.nbytes + 150 for docs, weights in bm25.postings.values()
+        )
+    exact = _exact_indexes.get(collection_name)
+    if exact is not None:
+        # Python strings and metadata dicts cost well over their text length
+        size += exact.nbytes + 2 * sum(len(document) for document in exact.documents)
+        size += 1000 * len(exact.ids)
+    for size_of, _ in _tenant_caches:
+        size += size_of(collection_name)
+    return size
+
+def unload_tenant(collection_name):
+    """Drop a tenant's loaded indexes from memory; their next query reloads them.
+
+    Unlike invalidate_user_cache this keeps the generation, since the
+    tenant's data has not changed.
+    """
+    with _embedders_lock:
+        _embedders.pop(collection_name, None)
+    with _bm25_lock:
+        _bm25_indexes.pop(collection_name, None)
+    with _exact_lock:
+        _exact_indexes.pop(collection_name, None)
+    _retrieval_settings.pop(collection_name, None)
+    with _handles_lock:
+        _collection_handles.pop(collection_name, None)
+    for _, unload in _tenant_caches:
+        unload(collection_name)
+    with _result_cache_lock:
+        for key in [key for key in _result_cache if key[0] == collection_name]:
+            del _result_cache[key]
+
+def register_tenant_cache(size_of, unload):
+    """Count a per-tenant cache kept elsewhere towards the memory budget.
+
+    ``size_of(collection_name)`` gives the bytes it holds for a tenant and
+    ``unload(collection_name)`` drops them when the tenant is unloaded.
+    """
+    _tenant_caches.append((size_of, unload))
+
+def touch_user(user_id, resized=False):
+    """Record a use of a user's loaded state from outside this module.
+
+    Pass ``resized`` after a registered cache changed what it holds for
+    them, so their size is measured again.
+    """
+    collection_name = get_user_collection_name(user_id)
+    if resized:
+        residency.resize(collection_name)
+    _record_access(collection_name)
+
+def _record_access(collection_name, active=True):
+    """Mark a tenant as just used and unload others if over the memory budget.
+
+    Only ``active`` uses (queries and stores, not warm-ups) count towards
+    the recently active tenants.
+    """
+    size = _resident_bytes(collection_name) if residency.needs_size(collection_name) else None
+    residency.touch(collection_name, size)
+    for victim in residency.victims(keep=collection_name):
+        unload_tenant(victim)
+    if not active:
+        return
+    _last_access[collection_name] = time.time()
+    # One request thread saves; the others carry on rather than wait
+    if time.time() - _recent_saved_at >= _RECENT_SAVE_INTERVAL and _recent_lock.acquire(blocking=False):
+        try:
+            if time.time() - _recent_saved_at >= _RECENT_SAVE_INTERVAL:
+                _save_recent_tenants()
+        finally:
+            _recent_lock.release()
+
+def _load_recent_tenants():
+    try:
+        with open(RECENT_TENANTS_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_recent_tenants():
+    """Merge this process's tenant access times into the on-disk list."""
+    with _recent_lock:
+        _save_recent_tenants()
+
+def _save_recent_tenants():
+    global _recent_saved_at
+    _recent_saved_at = time.time()
+    recent = _load_recent_tenants()
+    for collection_name, accessed_at in list(_last_access.items()):
+        recent[collection_name] = max(accessed_at, recent.get(collection_name, 0))
+    recent = dict(sorted(recent.items(), key=lambda entry: -entry[1])[:RECENT_TENANTS_MAX])
+    tmp_path = f"{RECENT_TENANTS_PATH}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CHROMA_PATH, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(recent, f)
+        os.replace(tmp_path, RECENT_TENANTS_PATH)
+    except OSError as e:
+        logger.error(f"Failed to save recent tenants: {str(e)}")
+
+def get_recent_tenants(limit=None):
+    """User IDs of the most recently queried tenants, most recent first."""
+    recent = _load_recent_tenants()
+    for collection_name, accessed_at in list(_last_access.items()):
+        recent[collection_name] = max(accessed_at, recent.get(collection_name, 0))
+    names = sorted(recent, key=lambda name: -recent[name])[:limit]
+    return [name[len("user_"):-len("_data")] for name in names
+            if name.startswith("user_") and name.endswith("_data")]
+
+def warm_user(user_id):
+    """Load a user's retrieval state ahead of their first query.
+
+    Returns False if the user has no data to load.
+    """
+    try:
+        collection = get_user_collection(user_id)
+        if collection is None:
+            return False
+        embedder = get_user_embedder(user_id)
+        get_user_bm25(user_id)
+        # A throwaway search pages in the vectors or ChromaDB's HNSW segment
+        probe = np.full((1, embedder.dim), 1.0 / np.sqrt(embedder.dim), dtype=np.float32)
+        collection.query(query_embeddings=probe.tolist(), n_results=1)
+        _record_access(get_user_collection_name(user_id), active=False)
+        return True
     except Exception as e:
-        logger.error(f"Error generating embedding: {str(e)}")
+        logger.error(f"Error warming user {user_id}: {str(e)}")
+        return False
+
+def get_resident_tenants():
+    """Tenants currently loaded in this process, with their estimated bytes."""
+    return residency.stats()
+
+def get_user_generation(user_id):
+    """Current data generation of a user; changes on every store or delete.
+
+    Changes made by other app processes are picked up here too, within
+    STAMP_CHECK_SECONDS.
+    """
+    collection_name = get_user_collection_name(user_id)
+    _sync_user_cache(collection_name)
+    return _generations.get(collection_name, 0)
+
+def invalidate_user_cache(user_id):
+    """Drop a user's cached handle and query results, here and in other processes."""
+    collection_name = get_user_collection_name(user_id)
+    _drop_cached_state(collection_name)
+    _write_stamp(collection_name)
+
+def get_user_collection(user_id):
+    """Get the object to query for a user's data, or None if they have none.
+
+    This is the user's exact index when they have one, otherwise their
+    ChromaDB collection. With VECTOR_BACKEND=http an exact index stored
+    earlier is used until the tenant's next sync moves them to ChromaDB.
+    Handles are cached per generation, so regular queries skip the
+    ChromaDB catalog lookup entirely.
+    """
+    collection_name = get_user_collection_name(user_id)
+    generation = get_user_generation(user_id)
+    cached = _collection_handles.get(collection_name)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+
+    handle = get_user_exact_index(user_id)
+    if handle is None:
+        try:
+            handle = get_user_client(user_id).get_collection(collection_name)
+        except Exception as e:
+            logger.info(f"No collection for user {user_id}: {str(e)}")
+            handle = None
+
+    with _handles_lock:
+        # Only cache if no invalidation happened while we were looking
+        if _generations.get(collection_name, 0) == generation:
+            _collection_handles[collection_name] = (generation, handle)
+    return handle
+
+def get_user_embedder(user_id):
+    """Get the embedder fitted on a user's corpus, loading it on first use."""
+    collection_name = get_user_collection_name(user_id)
+    embedder = _embedders.get(collection_name)
+    if embedder is not None:
+        return embedder
+
+    with _embedders_lock:
+        embedder = _embedders.get(collection_name)
+        if embedder is None:
+            path = os.path.join(get_tenant_dir(user_id), EMBEDDER_FILENAME)
+            try:
+                embedder = TenantEmbedder.load(path)
+            except Exception as e:
+                logger.error(f"Failed to load embedder for user {user_id}: {str(e)}")
+            if embedder is None:
+                embedder = legacy_embedder
+            _embedders[collection_name] = embedder
+        return embedder
+
+def fit_user_embedder(texts, user_id):
+    """Fit a new embedder on a user's corpus without making it current yet."""
+    try:
+        embedder = TenantEmbedder.fit(texts)
+    except ValueError as e:
+        # Raised when the corpus has no usable tokens at all
+        logger.warning(f"Could not fit embedder for user {user_id}, using fixed vocabulary: {str(e)}")
+        embedder = legacy_embedder
+    logger.info(f"Fitted embedder {embedder.version} ({len(embedder.vocabulary)} terms) for user {user_id}")
+    return embedder
+
+def save_user_embedder(embedder, user_id):
+    """Persist an embedder next to the user's collection and make it current.
+
+    Cached embeddings of the embedder it replaces are deleted, since no
+    stored vector uses that model any more.
+    """
+    previous = get_user_embedder(user_id)
+    path = os.path.join(get_tenant_dir(user_id), EMBEDDER_FILENAME)
+    embedder.save(path)
+    with _embedders_lock:
+        _embedders[get_user_collection_name(user_id)] = embedder
+    # The fixed-vocabulary embedder is shared by every legacy tenant
+    if previous is not legacy_embedder and previous.version != embedder.version:
+        embedding_cache.retire_version(previous.version)
+
+def get_user_bm25(user_id):
+    """Get the user's BM25 index, loading it on first use (None if they have no data).
+
+    Collections stored before BM25 indexing, or indexed with an older
+    tokenizer, get their index built from the stored documents on first use.
+    """
+    collection_name = get_user_collection_name(user_id)
+    if collection_name in _bm25_indexes:
+        return _bm25_indexes[collection_name]
+
+    with _bm25_lock:
+        if collection_name in _bm25_indexes:
+            return _bm25_indexes[collection_name]
+        path = os.path.join(get_tenant_dir(user_id), BM25_FILENAME)
+        try:
+            index = BM25Index.load(path)
+        except Exception as e:
+            logger.error(f"Failed to load BM25 index for user {user_id}: {str(e)}")
+            index = None
+        if index is not None:
+            _bm25_indexes[collection_name] = index
+            return index
+
+    # Read the corpus outside the lock, since opening the collection may
+    # itself drop this tenant's cached state
+    generation = get_user_generation(user_id)
+    index = None
+    try:
+        collection = get_user_collection(user_id)
+        if collection is not None:
+            stored = collection.get(include=["documents", "metadatas"])
+            if stored["ids"]:
+                content_types = [(metadata or {}).get("content_type") for metadata in stored["metadatas"]]
+                index = BM25Index.build(stored["ids"], stored["documents"], content_types)
+    except Exception as e:
+        logger.error(f"Failed to build BM25 index for user {user_id}: {str(e)}")
+
+    # An ingest since we started has saved an index of its own
+    if get_user_generation(user_id) != generation:
+        return get_user_bm25(user_id)
+    with _bm25_lock:
+        if index is not None:
+            try:
+                index.save(path)
+                logger.info(f"Built BM25 index for user {user_id} from {len(index.ids)} stored items")
+            except Exception as e:
+                logger.error(f"Failed to save BM25 index for user {user_id}: {str(e)}")
+        _bm25_indexes[collection_name] = index
+        return index
+
+def save_user_bm25(index, user_id):
+    """Persist a BM25 index next to the user's collection and make it current."""
+    index.save(os.path.join(get_tenant_dir(user_id), BM25_FILENAME))
+    with _bm25_lock:
+        _bm25_indexes[get_user_collection_name(user_id)] = index
+
+def get_user_exact_index(user_id):
+    """Get the user's exact index, loading it on first use (None if absent)."""
+    collection_name = get_user_collection_name(user_id)
+    if collection_name in _exact_indexes:
+        return _exact_indexes[collection_name]
+
+    with _exact_lock:
+        if collection_name not in _exact_indexes:
+            try:
+                _exact_indexes[collection_name] = ExactIndex.load(get_tenant_dir(user_id))
+            except Exception as e:
+                logger.error(f"Failed to load exact index for user {user_id}: {str(e)}")
+                _exact_indexes[collection_name] = None
+        return _exact_indexes[collection_name]
+
+def embed_texts(embedder, texts, persist=True):
+    """Embed texts as one matrix, only vectorising those not already cached."""
+    cached = embedding_cache.get_many(embedder.version, texts)
+    missing = [i for i, vector in enumerate(cached) if vector is None]
+    if missing:
+        computed = embedder.transform([texts[i] for i in missing])
+        embedding_cache.put_many(embedder.version, [texts[i] for i in missing], computed, persist=persist)
+        for row, i in enumerate(missing):
+            cached[i] = computed[row]
+    return np.vstack(cached) if cached else np.zeros((0, embedder.dim), dtype=np.float32)
+
+def get_embeddings(texts, user_id):
+    """Generate embeddings for a batch of texts as one matrix.
+
+    Query embeddings are cached in memory only; writing every customer
+    question to disk would cost more than re-vectorising it.
+    """
+    try:
+        return embed_texts(get_user_embedder(user_id), texts, persist=False)
+    except Exception as e:
+        logger.error(f"Error generating embeddings: {str(e)}")
+        return None
+
+def get_embedding(text, user_id):
+    """Generate an embedding for a single text with the user's embedder."""
+    embeddings = get_embeddings([text], user_id)
+    if embeddings is None:
         return None
+    return embeddings[0].tolist()
+
+def _digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def make_item_id(item, item_text):
+    """Stable item ID derived from the item's identity, not its full content.
+
+    Items with a natural key (SKU, name, question, ...) keep their ID when
+    other fields such as the price change, so a sync updates them in place.
+    Items without one are addressed by their content.
+    """
+    if isinstance(item, dict):
+        for field in ITEM_KEY_FIELDS:
+            value = item.get(field)
+            if isinstance(value, (str, int)) and str(value).strip():
+                return f"item_{_digest(f'{field}:{str(value).strip().lower()}')[:16]}"
+    return f"item_{_digest(item_text)[:16]}"
+
+def _item_entries(item, item_id, item_text, item_type):
+    """Index entries for one item as (id, document, metadata) triples.
+
+    Short items become a single entry. Items with string fields longer
+    than PASSAGE_MAX_CHARS get one entry per overlapping passage of each
+    long field; every passage keeps the item's short fields and points
+    back to the item through ``parent_id``. Every entry carries its
+    ``context_card`` (see build_card) so answering never re-renders it.
+    """
+    long_fields = []
+    if isinstance(item, dict):
+        long_fields = [
+            key for key, value in item.items()
+            if isinstance(value, str) and len(value) > PASSAGE_MAX_CHARS
+        ]
+
+    if not long_fields:
+        projection = project_metadata(item)
+        metadata = {**projection, "content_type": item_type}
+        metadata["context_card"] = build_card(item_text, metadata)
+        # The hash covers the metadata too, so projection and card format
+        # changes get rewritten
+        content_hash = _digest(json.dumps([item_text, metadata], ensure_ascii=False, sort_keys=True))
+        return [(item_id, item_text, {**metadata, "content_hash": content_hash})]
+
+    base = {key: value for key, value in item.items() if key not in long_fields}
+    projection = project_metadata(base)
+    entries = []
+    for field in long_fields:
+        passages = split_passages(item[field])
+        for index, (start, passage) in enumerate(passages):
+            document = json.dumps({**base, field: passage}, ensure_ascii=False, sort_keys=True)
+            metadata = {
+                **projection,
+                "content_type": item_type,
+                "parent_id": item_id,
+                "passage_field": field,
+                "passage_index": index,
+                "passage_count": len(passages),
+                "passage_start": start
+            }
+            metadata["context_card"] = build_card(document, metadata)
+            content_hash = _digest(json.dumps([document, metadata], ensure_ascii=False, sort_keys=True))
+            entries.append((f"{item_id}#{field}:{index}", document, {**metadata, "content_hash": content_hash}))
+    return entries
+
+def _prepare_items(data, user_id, content_type=None):
+    """Serialise items into parallel id/document/metadata lists keyed by stable IDs.
+
+    Metadata is a flat, typed projection of the item (see
+    project_metadata) plus its content type, which is ``content_type``
+    when given and otherwise inferred per item. Long items are split
+    into passages (see _item_entries).
+    """
+    ids, documents, metadatas = [], [], []
+    seen_ids = set()
+    for i, item in enumerate(data):
+        try:
+            item_text = json.dumps(item, ensure_ascii=False, sort_keys=True)
+            item_type = content_type if content_type in CONTENT_TYPES else classify_item(item)
+            item_id = make_item_id(item, item_text)
+            if item_id in seen_ids:
+                # Same natural key twice (e.g. two sizes of one product)
+                item_id = f"{item_id}_{_digest(item_text)[:8]}"
+                if item_id in seen_ids:
+                    continue
+            seen_ids.add(item_id)
+            for entry_id, document, metadata in _item_entries(item, item_id, item_text, item_type):
+                ids.append(entry_id)
+                documents.append(document)
+                metadatas.append({**metadata, "user_id": user_id})
+        except Exception as e:
+            logger.error(f"Error processing item {i+1}: {str(e)}")
+            continue
+    return ids, documents, metadatas
+
+def _existing_hashes(collection):
+    """Map of item ID to content hash for everything already in a collection."""
+    existing = collection.get(include=["metadatas"])
+    return {
+        item_id: (metadata or {}).get("content_hash")
+        for item_id, metadata in zip(existing["ids"], existing["metadatas"])
+    }
+
+def _open_collection(user_id):
+    """Get the user's ChromaDB collection, creating it if needed."""
+    return get_user_client(user_id).get_or_create_collection(
+        name=get_user_collection_name(user_id),
+        metadata={
+            "description": f"Business data collection for user {user_id}",
+            "user_id": user_id,
+            "created_at": time.time()
+        }
+    )
+
+def _write_exact_index(user_id, ids, documents, metadatas, embedder, previous):
+    """Write a user's full corpus as an exact index, reusing cached vectors.
+
+    The index and its embedder become current together.
+    """
+    previous_metadata = {}
+    if previous is not None:
+        previous_metadata = dict(zip(previous.ids, previous.metadatas))
+
+    stored_at = time.time()
+    item_metadatas = []
+    for item_id, metadata in zip(ids, metadatas):
+        old = previous_metadata.get(item_id)
+        if old and old.get("content_hash") == metadata["content_hash"]:
+            item_metadatas.append(old)
+        else:
+            item_metadatas.append({**metadata, "stored_at": stored_at})
+
+    # Unchanged items come straight from the embedding cache
+    embeddings = embed_texts(embedder, documents)
+    index = ExactIndex(ids, documents, item_metadatas, embeddings)
+    index.save(get_tenant_dir(user_id))
+    if embedder is not get_user_embedder(user_id):
+        save_user_embedder(embedder, user_id)
+    with _exact_lock:
+        _exact_indexes[get_user_collection_name(user_id)] = index
+    logger.info(f"Wrote exact index with {len(ids)} items for user {user_id}")
+    return True
+
+def _upsert_chunks(collection, ids, documents, metadatas, embeddings, positions, batch_size, progress_callback):
+    """Upsert ``positions`` of the corpus in chunks; returns how many were written."""
+    stored_at = time.time()
+    successful_stores = 0
+    total = len(positions)
+    chunk_count = (total + batch_size - 1) // batch_size
+    for chunk_index, start in enumerate(range(0, total, batch_size), 1):
+        chunk = positions[start:start + batch_size]
+        try:
+            collection.upsert(
+                ids=[ids[i] for i in chunk],
+                embeddings=embeddings[start:start + batch_size].tolist(),
+                documents=[documents[i] for i in chunk],
+                metadatas=[{**metadatas[i], "stored_at": stored_at} for i in chunk]
+            )
+            successful_stores += len(chunk)
+            logger.info(f"Wrote chunk {chunk_index}/{chunk_count} ({successful_stores}/{total} items) to collection {collection.name}")
+        except Exception as e:
+            logger.error(f"Error writing chunk {chunk_index}/{chunk_count}: {str(e)}")
+            continue
+
+        if progress_callback:
+            progress_callback(successful_stores, total)
+    return successful_stores
+
+def _rebuild_collection(user_id, ids, documents, metadatas, embeddings, embedder, batch_size, progress_callback):
+    """Write a full re-embed into a shadow collection, then swap it in.
+
+    Queries keep using the old collection and embedder until the shadow
+    is complete; the new collection and embedder then become current
+    together and the old collection is dropped. A failed write only
+    discards the shadow.
+    """
+    collection_name = get_user_collection_name(user_id)
+    shadow_name, retired_name = (f"{collection_name}{suffix}" for suffix in SHADOW_SUFFIXES)
+    client = get_user_client(user_id)
+    for name in (shadow_name, retired_name):
+        try:
+            # Left over from an interrupted rebuild
+            client.delete_collection(name)
+        except Exception:
+            pass
+
+    shadow = client.create_collection(name=shadow_name, metadata={
+        "description": f"Business data collection for user {user_id}",
+        "user_id": user_id,
+        "created_at": time.time()
+    })
+    written = _upsert_chunks(shadow, ids, documents, metadatas, embeddings,
+                             list(range(len(ids))), batch_size, progress_callback)
+    if written < len(ids):
+        logger.error(f"Only {written}/{len(ids)} items written for user {user_id}, keeping the current collection")
+        client.delete_collection(shadow_name)
+        return False
+
+    # Handles already open on the old collection keep working while it is renamed
+    client.get_collection(collection_name).modify(name=retired_name)
+    shadow.modify(name=collection_name)
+    save_user_embedder(embedder, user_id)
+    invalidate_user_cache(user_id)
+    client.delete_collection(retired_name)
+    logger.info(f"Rebuilt collection {collection_name} with {written} items for embedder {embedder.version}")
+    return True
+
+def _write_collection(user_id, ids, documents, metadatas, embedder, previous_embedder,
+                      batch_size, progress_callback):
+    """Bring the user's collection up to date with their corpus.
 
-def store_data_in_chroma(data, user_id):
-    """Store data in ChromaDB with embeddings for a specific user."""
+    With an unchanged embedder, new and changed items are upserted and
+    removed ones deleted in place. A new embedder rewrites every vector,
+    so the collection is rebuilt beside the current one (see
+    _rebuild_collection) and never holds vectors from two models.
+    """
+    collection_name = get_user_collection_name(user_id)
+    try:
+        collection = _open_collection(user_id)
+        existing = _existing_hashes(collection)
+    except Exception as e:
+        logger.error(f"Failed to open collection: {str(e)}")
+        return False
+
+    rebuild = bool(existing) and embedder.version != previous_embedder.version
+    if rebuild or not existing:
+        positions = list(range(len(ids)))
+    else:
+        positions = [
+            i for i, item_id in enumerate(ids)
+            if existing.get(item_id) != metadatas[i]["content_hash"]
+        ]
+    new_ids = set(ids)
+    deleted = [item_id for item_id in existing if item_id not in new_ids]
+
+    # Vectorise everything that needs writing as one matrix
+    try:
+        embeddings = embed_texts(embedder, [documents[i] for i in positions])
+    except Exception as e:
+        logger.error(f"Failed to generate embeddings for batch: {str(e)}")
+        return False
+
+    if rebuild:
+        try:
+            return _rebuild_collection(user_id, ids, documents, metadatas, embeddings, embedder,
+                                       batch_size, progress_callback)
+        except Exception as e:
+            logger.error(f"Failed to rebuild collection {collection_name}: {str(e)}")
+            return False
+
+    successful_stores = _upsert_chunks(collection, ids, documents, metadatas, embeddings, positions,
+                                       batch_size, progress_callback)
+    total = len(positions)
+    if successful_stores < total:
+        # Keep removed items until a retry writes their replacements
+        logger.error(f"Only {successful_stores}/{total} items written for user {user_id}")
+        return False
+
+    for start in range(0, len(deleted), batch_size):
+        try:
+            collection.delete(ids=deleted[start:start + batch_size])
+        except Exception as e:
+            logger.error(f"Error deleting stale items from {collection_name}: {str(e)}")
+
+    if embedder is not previous_embedder:
+        # A new tenant's first write
+        save_user_embedder(embedder, user_id)
+    logger.info(f"Wrote {successful_stores} items and removed {len(deleted)} from collection {collection_name}")
+    return True
+
+def store_data_in_chroma(data, user_id, batch_size=None, progress_callback=None, content_type=None):
+    """Sync a user's data into their vector index, writing only what changed.
+
+    Items get stable IDs (see make_item_id) and a content hash, and the
+    existing index is diffed against the new data. Tenants with at most
+    EXACT_INDEX_MAX_ITEMS items are stored as an exact NumPy index
+    (see ExactIndex); larger ones go to ChromaDB, where new and changed
+    items are upserted and missing ones deleted in chunks of
+    ``batch_size`` (defaults to CHROMA_INGEST_BATCH_SIZE). Neither backend
+    is ever emptied, so the data stays queryable during the sync. If
+    given, ``progress_callback(written, total)`` is called after every
+    ChromaDB chunk. ``content_type`` tags every item with one of
+    CONTENT_TYPES; without it each item's type is inferred.
+    """
     try:
         if not data:
             logger.error("No data provided to store in ChromaDB")
@@ -73,129 +846,432 @@ def store_data_in_chroma(data, user_id):
             logger.error("No user ID provided")
             return False
 
-        logger.info(f"Starting to store {len(data)} items for user {user_id}")
+        batch_size = batch_size or INGEST_BATCH_SIZE
+        started = time.time()
+        logger.info(f"Starting to sync {len(data)} items for user {user_id}")
 
-        # Create or get user-specific collection
         collection_name = get_user_collection_name(user_id)
         logger.info(f"Collection name: {collection_name}")
-        
-        # Always delete existing collection to avoid dimension issues
-        try:
-            chroma_client.delete_collection(collection_name)
-            logger.info(f"Deleted existing collection {collection_name}")
-        except Exception as e:
-            logger.info(f"No existing collection to delete: {str(e)}")
-        
-        # Create new collection
-        try:
-            collection = chroma_client.create_collection(
-                name=collection_name,
-                metadata={
-                    "description": f"Business data collection for user {user_id}",
-                    "user_id": user_id,
-                    "created_at": time.time()
-                }
+        # Diff against what other processes have stored, not a stale copy
+        _sync_user_cache(collection_name, force=True)
+
+        ids, documents, metadatas = _prepare_items(data, user_id, content_type)
+        if not documents:
+            logger.error("No valid items to store in ChromaDB")
+            return False
+
+        # Diff against whichever backend currently holds the user's data
+        previous_exact = get_user_exact_index(user_id)
+        if previous_exact is not None:
+            existing = {
+                item_id: metadata.get("content_hash")
+                for item_id, metadata in zip(previous_exact.ids, previous_exact.metadatas)
+            }
+        else:
+            try:
+                existing = _existing_hashes(get_user_client(user_id).get_collection(collection_name))
+            except Exception:
+                existing = {}
+
+        new_hashes = {item_id: metadata["content_hash"] for item_id, metadata in zip(ids, metadatas)}
+        added = [item_id for item_id in ids if item_id not in existing]
+        updated = [item_id for item_id in ids if item_id in existing and existing[item_id] != new_hashes[item_id]]
+        deleted = [item_id for item_id in existing if item_id not in new_hashes]
+        changed = len(added) + len(updated) + len(deleted)
+        logger.info(f"Sync plan for {collection_name}: {len(added)} new, {len(updated)} changed, {len(deleted)} removed, {len(ids) - len(added) - len(updated)} unchanged")
+
+        # Refit the embedder only for a new tenant, one fitted before plurals
+        # were folded, or a substantial change, since a new model means every
+        # stored vector has to be rewritten
+        current_embedder = get_user_embedder(user_id)
+        refit = (
+            current_embedder is legacy_embedder
+            or not current_embedder.fold_plurals
+            or not existing
+            or changed > EMBEDDER_REFIT_RATIO * max(len(existing), 1)
+        )
+        embedder = fit_user_embedder(documents, user_id) if refit else current_embedder
+
+        use_exact = len(ids) <= EXACT_INDEX_MAX_ITEMS
+        if use_exact:
+            success = _write_exact_index(user_id, ids, documents, metadatas, embedder, previous_exact)
+        else:
+            success = _write_collection(
+                user_id, ids, documents, metadatas, embedder, current_embedder,
+                batch_size, progress_callback
             )
-            logger.info(f"Created new collection {collection_name}")
-        except Exception as e:
-            logger.error(f"Failed to create collection: {str(e)}")
+        if not success:
+            # The previous model stays current, so a retry diffs against the same vectors
             return False
-        
-        # Process each item
-        successful_stores = 0
-        for i, item in enumerate(data):
+
+        # The lexical index is small enough to rebuild over the whole corpus
+        content_types = [metadata["content_type"] for metadata in metadatas]
+        save_user_bm25(BM25Index.build(ids, documents, content_types), user_id)
+
+        # Point queries at the new data before retiring the backend the
+        # tenant no longer uses, then once more after it is gone
+        if not use_exact and previous_exact is not None:
+            with _exact_lock:
+                _exact_indexes[collection_name] = None
+        invalidate_user_cache(user_id)
+        if use_exact:
             try:
-                logger.info(f"Processing item {i+1}/{len(data)}")
-                
-                # Convert item to string for embedding
-                item_text = json.dumps(item, ensure_ascii=False)
-                logger.debug(f"Item text length: {len(item_text)}")
-                
-                # Get embedding
-                embedding = get_embedding(item_text)
-                if not embedding:
-                    logger.warning(f"Failed to get embedding for item {i+1}")
-                    continue
-                
-                logger.info(f"Generated embedding with {len(embedding)} dimensions")
-                
-                # Create unique ID
-                item_id = f"item_{hash(item_text)}_{user_id}"
-                
-                # Store in ChromaDB
-                collection.add(
-                    ids=[item_id],
-                    embeddings=[embedding],
-                    documents=[item_text],
-                    metadatas=[{
-                        **item,
-                        "user_id": user_id,
-                        "stored_at": time.time()
-                    }]
-                )
-                successful_stores += 1
-                logger.info(f"Successfully stored item {successful_stores} in collection {collection_name}")
-                
-            except Exception as e:
-                logger.error(f"Error processing item {i+1}: {str(e)}")
-                continue
-        
-        logger.info(f"Successfully stored {successful_stores} items in ChromaDB for user {user_id}")
-        return successful_stores > 0
+                get_user_client(user_id).delete_collection(collection_name)
+                logger.info(f"Moved user {user_id} from ChromaDB to the exact index")
+            except Exception:
+                pass
+        elif previous_exact is not None:
+            ExactIndex.remove(get_tenant_dir(user_id))
+            with _exact_lock:
+                # In case the tenant was unloaded and reloaded meanwhile
+                _exact_indexes[collection_name] = None
+            logger.info(f"Moved user {user_id} from the exact index to ChromaDB")
+
+        invalidate_user_cache(user_id)
+        _record_access(collection_name)
+        logger.info(f"Synced {len(ids)} items for user {user_id} in {time.time() - started:.2f}s")
+        logger.info(f"Embedding cache: {embedding_cache.stats()}")
+        return True
         
     except Exception as e:
         logger.error(f"Error storing data in ChromaDB: {str(e)}")
         return False
 
-def query_chroma(query_text, user_id, n_results=5):
-    """Query ChromaDB for similar documents for a specific user."""
+def reciprocal_rank_fusion(rankings, k=None):
+    """Fuse ranked ID lists into one ranking of (id, score) pairs."""
+    k = k or RRF_K
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+
+def _content_type_filter(content_types):
+    """ChromaDB ``where`` clause restricting results to some content types."""
+    if not content_types:
+        return None
+    if len(content_types) == 1:
+        return {"content_type": content_types[0]}
+    return {"content_type": {"$in": list(content_types)}}
+
+def _expand_passages(collection, result, neighbors):
+    """Widen passage hits in a query result with their neighbouring passages.
+
+    Each passage hit's document is replaced by its field's text from
+    ``neighbors`` passages before to ``neighbors`` after it, and hits
+    already covered by an earlier, better-ranked window are dropped.
+    """
+    wanted = set()
+    for metadata in result['metadatas'][0]:
+        if metadata and metadata.get("parent_id"):
+            index = metadata["passage_index"]
+            for j in range(max(0, index - neighbors), min(metadata["passage_count"], index + neighbors + 1)):
+                wanted.add(f'{metadata["parent_id"]}#{metadata["passage_field"]}:{j}')
+    if not wanted:
+        return result
+
+    fetched = collection.get(ids=list(wanted), include=["documents", "metadatas"])
+    passages = dict(zip(fetched['ids'], zip(fetched['documents'], fetched['metadatas'])))
+
+    expanded = {key: [] for key in result}
+    covered = set()
+    for position, item_id in enumerate(result['ids'][0]):
+        document = result['documents'][0][position]
+        metadata = result['metadatas'][0][position]
+        if metadata and metadata.get("parent_id"):
+            if item_id in covered:
+                continue
+            field = metadata["passage_field"]
+            index = metadata["passage_index"]
+            window = []
+            for j in range(max(0, index - neighbors), min(metadata["passage_count"], index + neighbors + 1)):
+                neighbor_id = f'{metadata["parent_id"]}#{field}:{j}'
+                if neighbor_id in passages:
+                    neighbor_document, neighbor_metadata = passages[neighbor_id]
+                    window.append((neighbor_metadata["passage_start"], json.loads(neighbor_document)[field]))
+                    covered.add(neighbor_id)
+            if window:
+                parsed = json.loads(document)
+                parsed[field] = merge_passages(window)
+                document = json.dumps(parsed, ensure_ascii=False, sort_keys=True)
+                # The stored card shows only the single passage
+                metadata = {**metadata, "context_card": build_card(document, metadata)}
+        for key in result:
+            value = document if key == 'documents' else metadata if key == 'metadatas' else result[key][0][position]
+            expanded[key].append(value)
+    return {key: [values] for key, values in expanded.items()}
+
+def get_user_min_relevance(user_id):
+    """Relevance below which a user's adaptive retrieval drops hits."""
+    collection_name = get_user_collection_name(user_id)
+    settings = _retrieval_settings.get(collection_name)
+    if settings is None:
+        try:
+            with open(os.path.join(get_tenant_dir(user_id), RETRIEVAL_SETTINGS_FILENAME), "r", encoding="utf-8") as f:
+                settings = json.load(f)
+        except (OSError, ValueError):
+            settings = {}
+        _retrieval_settings[collection_name] = settings
+    return float(settings.get("min_relevance", RELEVANCE_THRESHOLD))
+
+def set_user_min_relevance(user_id, min_relevance):
+    """Set (or with None, reset) a user's relevance threshold."""
+    try:
+        collection_name = get_user_collection_name(user_id)
+        tenant_dir = get_tenant_dir(user_id)
+        settings = {} if min_relevance is None else {"min_relevance": float(min_relevance)}
+        os.makedirs(tenant_dir, exist_ok=True)
+        path = os.path.join(tenant_dir, RETRIEVAL_SETTINGS_FILENAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(settings, f)
+        os.replace(tmp_path, path)
+        _retrieval_settings[collection_name] = settings
+        # Cached results and answers were chosen with the old threshold
+        invalidate_user_cache(user_id)
+        logger.info(f"Set relevance threshold for user {user_id} to {settings.get('min_relevance', 'default')}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to set relevance threshold for user {user_id}: {str(e)}")
+        return False
+
+def relevance_cutoff(relevance, threshold, gap_ratio=None, min_results=None):
+    """Pick how many hits to keep from their relevance scores.
+
+    Hits below ``threshold`` are dropped; the rest are cut at the largest
+    drop between consecutive scores (the elbow) past the first
+    ``min_results``, if it is at least ``gap_ratio`` of the best score.
+    Returns ``(k, cutoff)``, where ``cutoff`` is the lowest relevance kept.
+    """
+    gap_ratio = RELEVANCE_GAP_RATIO if gap_ratio is None else gap_ratio
+    min_results = max(1, RELEVANCE_MIN_RESULTS if min_results is None else min_results)
+    ranked = sorted((score for score in relevance if score >= threshold), reverse=True)
+    if not ranked:
+        return 0, threshold
+    if len(ranked) > min_results:
+        gaps = [ranked[i] - ranked[i + 1] for i in range(len(ranked) - 1)]
+        elbow = max(range(min_results - 1, len(gaps)), key=gaps.__getitem__)
+        if gaps[elbow] >= gap_ratio * ranked[0]:
+            return elbow + 1, ranked[elbow]
+    return len(ranked), ranked[-1]
+
+def _result_cache_key(collection_name, generation, embedding, query_text, options):
+    """Cache key for one query: its quantized embedding plus its lexical terms.
+
+    Quantizing to int8 lets trivially different phrasings that embed the
+    same share an entry; the term set keeps the BM25 side exact.
+    """
+    quantized = np.round(np.asarray(embedding) * 127).astype(np.int8).tobytes()
+    terms = tuple(sorted(set(tokenize(query_text))))
+    return (collection_name, generation, quantized, terms, options)
+
+def query_chroma(query_text, user_id, n_results=5, route=True, expand_neighbors=None, adaptive=False):
+    """Query a user's data with hybrid lexical and vector retrieval.
+
+    BM25 and vector candidates are combined with reciprocal rank fusion.
+    The result keeps ChromaDB's shape (``ids``, ``documents``,
+    ``metadatas``, ``distances``) plus the fused ``scores`` and each hit's
+    ``relevance`` from 0 to 1: the better of its cosine similarity and
+    its BM25 score over the best the query could get. ``distances`` is
+    None for hits found only lexically. With ``route`` the question is
+    classified first and only matching content types are searched.
+    Passage hits from long documents are widened by ``expand_neighbors``
+    passages on each side (defaults to PASSAGE_NEIGHBORS).
+
+    With ``adaptive``, ``n_results`` is an upper bound: hits are cut with
+    relevance_cutoff at the user's threshold, and the result's
+    ``diagnostics`` records the candidates, chosen k and cutoff.
+    """
+    results = query_chroma_many([query_text], user_id, n_results=n_results, route=route,
+                                expand_neighbors=expand_neighbors, adaptive=adaptive)
+    return results[0] if results else None
+
+def query_chroma_many(queries, user_id, n_results=5, route=True, expand_neighbors=None, adaptive=False):
+    """Run several queries against a user's data in one retrieval round.
+
+    All queries are embedded as one matrix and sent to the collection as
+    multi-embedding queries, one per distinct content-type route. Queries
+    that find nothing within their route are retried unrestricted.
+    Results are memoized per tenant generation (see RESULT_CACHE_SIZE)
+    and shared between callers, so treat them as read-only. Returns a
+    list with one result per query, shaped like query_chroma's (None
+    where nothing was found), or None if the user's data could not be
+    queried at all.
+    """
     try:
         if not user_id:
             logger.error("No user ID provided for query")
             return None
 
         collection_name = get_user_collection_name(user_id)
-        logger.info(f"Querying collection: {collection_name}")
-        
-        try:
-            collection = chroma_client.get_collection(collection_name)
-            logger.info(f"Found collection: {collection_name}")
-        except Exception as e:
-            logger.error(f"Collection not found for user {user_id}: {str(e)}")
+        logger.info(f"Querying collection {collection_name} with {len(queries)} queries")
+
+        # Read the generation before the handle, so results fetched from an
+        # outdated collection can only be cached under an outdated generation
+        generation = get_user_generation(user_id)
+        collection = get_user_collection(user_id)
+        if collection is None:
+            logger.error(f"Collection not found for user {user_id}")
             return None
         
-        # Get embedding for query
-        query_embedding = get_embedding(query_text)
-        if not query_embedding:
-            logger.error("Failed to get embedding for query")
+        query_embeddings = get_embeddings(queries, user_id)
+        if query_embeddings is None:
+            logger.error("Failed to get embeddings for queries")
             return None
-            
-        logger.info(f"Generated query embedding with {len(query_embedding)} dimensions")
-            
-        # Query the collection without metadata filtering first
+
+        candidate_count = max(n_results * 2, HYBRID_CANDIDATES)
+        routes = [classify_question(query) if route else None for query in queries]
+        neighbors = PASSAGE_NEIGHBORS if expand_neighbors is None else expand_neighbors
+
+        threshold = get_user_min_relevance(user_id) if adaptive else None
+
+        # Serve repeated queries from the result cache
+        options = (n_results, route, neighbors, adaptive, threshold)
+        keys = [
+            _result_cache_key(collection_name, generation, embedding, query, options)
+            for embedding, query in zip(query_embeddings, queries)
+        ]
+        merged = [None] * len(queries)
+        misses = []
+        with _result_cache_lock:
+            for i, key in enumerate(keys):
+                if key in _result_cache:
+                    _result_cache.move_to_end(key)
+                    merged[i] = _result_cache[key]
+                else:
+                    misses.append(i)
+        if not misses:
+            logger.info(f"Served {len(queries)} queries for {collection_name} from the result cache")
+            _record_access(collection_name)
+            return merged
+        queries = [queries[i] for i in misses]
+        query_embeddings = query_embeddings[misses]
+        routes = [routes[i] for i in misses]
+
         try:
-            results = collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results,
-                include=["documents", "metadatas", "distances"]  # Include all relevant data
-            )
-            
-            logger.info(f"Raw query results: {results}")
-            
-            if not results or not results.get('documents') or not results['documents'][0]:
-                logger.warning(f"No results found in collection {collection_name}")
-                return None
-                
-            logger.info(f"Successfully queried collection {collection_name} with {len(results.get('documents', [[]])[0])} results")
-            
-            # Sort results by distance if available
-            if results.get('distances'):
-                sorted_indices = np.argsort(results['distances'][0])
-                results['documents'][0] = [results['documents'][0][i] for i in sorted_indices]
-                results['metadatas'][0] = [results['metadatas'][0][i] for i in sorted_indices]
-                results['distances'][0] = [results['distances'][0][i] for i in sorted_indices]
-            
-            return results
+            found = {}
+            vector_rankings = [[] for _ in queries]
+            # A query with no in-vocabulary terms embeds to zeros; its
+            # nearest neighbours would be arbitrary, so skip the vector side
+            groups = {}
+            for i, embedding in enumerate(query_embeddings):
+                if embedding.any():
+                    groups.setdefault(tuple(routes[i] or ()), []).append(i)
+
+            for content_types, rows in groups.items():
+                where = _content_type_filter(content_types)
+                query_args = {
+                    "query_embeddings": query_embeddings[rows].tolist(),
+                    "n_results": candidate_count,
+                    "include": ["documents", "metadatas", "distances"]
+                }
+                try:
+                    vector_results = collection.query(where=where, **query_args) if where else collection.query(**query_args)
+                except Exception as e:
+                    # Collections stored before content types existed reject the filter
+                    logger.warning(f"Filtered query failed on {collection_name}, retrying unfiltered: {str(e)}")
+                    vector_results = collection.query(**query_args)
+
+                for row, query_index in enumerate(rows):
+                    for item_id, doc, metadata, distance in zip(
+                        vector_results['ids'][row], vector_results['documents'][row],
+                        vector_results['metadatas'][row], vector_results['distances'][row]
+                    ):
+                        # Squared L2 between unit vectors is 2 - 2cos; at 2 or more
+                        # the item shares no terms with the query
+                        if distance >= ORTHOGONAL_DISTANCE:
+                            continue
+                        found[(query_index, item_id)] = (doc, metadata, distance)
+                        vector_rankings[query_index].append(item_id)
+
+            bm25 = get_user_bm25(user_id)
+            fused_rankings = []
+            lexical_relevance = []
+            for query_index, query_text in enumerate(queries):
+                lexical = []
+                if bm25 is not None:
+                    lexical = bm25.search(query_text, candidate_count, content_types=routes[query_index])
+                bound = bm25.score_bound(query_text) if lexical else 0.0
+                lexical_relevance.append({item_id: score / bound for item_id, score in lexical} if bound else {})
+                fused = reciprocal_rank_fusion([vector_rankings[query_index], [item_id for item_id, _ in lexical]])
+                fused_rankings.append(fused[:n_results])
+
+            # Fetch lexical-only hits for every query with one get()
+            missing = {
+                item_id
+                for query_index, fused in enumerate(fused_rankings)
+                for item_id, _ in fused
+                if (query_index, item_id) not in found
+            }
+            lexical_hits = {}
+            if missing:
+                fetched = collection.get(ids=list(missing), include=["documents", "metadatas"])
+                for item_id, doc, metadata in zip(fetched['ids'], fetched['documents'], fetched['metadatas']):
+                    lexical_hits[item_id] = (doc, metadata, None)
+
+            all_results = []
+            diagnostics = {}
+            for query_index, fused in enumerate(fused_rankings):
+                hits = [
+                    (item_id, score, found.get((query_index, item_id)) or lexical_hits.get(item_id))
+                    for item_id, score in fused
+                ]
+                hits = [hit for hit in hits if hit[2] is not None]
+                relevance = [
+                    round(max(0.0 if item[2] is None else 1.0 - item[2] / 2.0,
+                              lexical_relevance[query_index].get(item_id, 0.0)), 4)
+                    for item_id, _, item in hits
+                ]
+                if adaptive:
+                    k, cutoff = relevance_cutoff(relevance, threshold)
+                    kept = [i for i, score in enumerate(relevance) if score >= cutoff] if k else []
+                    diagnostics[query_index] = {
+                        "candidates": len(hits), "k": len(kept), "threshold": threshold,
+                        "cutoff": cutoff, "relevance": relevance
+                    }
+                    hits = [hits[i] for i in kept]
+                    relevance = [relevance[i] for i in kept]
+                if not hits:
+                    all_results.append(None)
+                    continue
+                all_results.append({
+                    'ids': [[item_id for item_id, _, _ in hits]],
+                    'documents': [[item[0] for _, _, item in hits]],
+                    'metadatas': [[item[1] for _, _, item in hits]],
+                    'distances': [[item[2] for _, _, item in hits]],
+                    'scores': [[score for _, score, _ in hits]],
+                    'relevance': [relevance]
+                })
+
+            if neighbors > 0:
+                all_results = [
+                    _expand_passages(collection, result, neighbors) if result else None
+                    for result in all_results
+                ]
+            for query_index, result in enumerate(all_results):
+                if result is not None and query_index in diagnostics:
+                    result['diagnostics'] = diagnostics[query_index]
+
+            # A misrouted question should still get an answer from everything
+            retry = [i for i, result in enumerate(all_results) if result is None and routes[i]]
+            if retry:
+                retried = query_chroma_many([queries[i] for i in retry], user_id, n_results=n_results,
+                                            route=False, expand_neighbors=expand_neighbors, adaptive=adaptive)
+                for i, result in zip(retry, retried or []):
+                    all_results[i] = result
+
+            answered = sum(result is not None for result in all_results)
+            logger.info(f"Queried collection {collection_name}: {answered}/{len(queries)} queries with results, {len(keys) - len(misses)} cached")
+
+            with _result_cache_lock:
+                for i, result in zip(misses, all_results):
+                    merged[i] = result
+                    _result_cache[keys[i]] = result
+                    _result_cache.move_to_end(keys[i])
+                while len(_result_cache) > RESULT_CACHE_SIZE:
+                    _result_cache.popitem(last=False)
+            _record_access(collection_name)
+            return merged
             
         except Exception as e:
             logger.error(f"Error querying collection: {str(e)}")
@@ -205,6 +1281,159 @@ def query_chroma(query_text, user_id, n_results=5):
         logger.error(f"Error querying ChromaDB: {str(e)}")
         return None
 
+_PASSAGE_FIELDS = ('parent_id', 'passage_field', 'passage_index', 'passage_count', 'passage_start', 'context_card')
+
+def get_user_catalog(user_id, max_entries=None):
+    """Every item a user has stored, as parallel document and metadata lists.
+
+    Items split into passages are joined back into one whole item whose
+    metadata has no context card. Returns None if the user has no data,
+    or more than ``max_entries`` index entries (checked before reading
+    anything).
+    """
+    try:
+        collection = get_user_collection(user_id)
+        if collection is None:
+            return None
+        if max_entries is not None and collection.count() > max_entries:
+            return None
+        stored = collection.get(include=["documents", "metadatas"])
+
+        documents, metadatas = [], []
+        parents = {}
+        for document, metadata in zip(stored['documents'], stored['metadatas']):
+            metadata = metadata or {}
+            if not metadata.get("parent_id"):
+                documents.append(document)
+                metadatas.append(metadata)
+                continue
+            parent = parents.setdefault(metadata["parent_id"], (document, metadata, {}))
+            parent[2].setdefault(metadata["passage_field"], []).append(
+                (metadata["passage_start"], json.loads(document)[metadata["passage_field"]])
+            )
+        for document, metadata, fields in parents.values():
+            item = json.loads(document)
+            for field, passages in fields.items():
+                item[field] = merge_passages(passages)
+            documents.append(json.dumps(item, ensure_ascii=False, sort_keys=True))
+            metadatas.append({key: value for key, value in metadata.items() if key not in _PASSAGE_FIELDS})
+        return documents, metadatas
+    except Exception as e:
+        logger.error(f"Error reading catalog for user {user_id}: {str(e)}")
+        return None
+
+def export_user_index(user_id):
+    """A user's stored items and vectors with the embedder that made them.
+
+    Returns a dict with ``embedder``, ``ids``, ``documents``,
+    ``metadatas`` and a float32 ``vectors`` matrix (dequantized if the
+    exact index keeps only a quantized copy), or None if the user has no
+    data.
+    """
+    try:
+        collection = get_user_collection(user_id)
+        if collection is None:
+            return None
+        embedder = get_user_embedder(user_id)
+        if isinstance(collection, ExactIndex):
+            return {
+                "embedder": embedder,
+                "ids": collection.ids,
+                "documents": collection.documents,
+                "metadatas": collection.metadatas,
+                "vectors": collection.dense_vectors()
+            }
+
+        ids, documents, metadatas, vectors = [], [], [], []
+        total = collection.count()
+        for offset in range(0, total, INGEST_BATCH_SIZE):
+            page = collection.get(
+                limit=INGEST_BATCH_SIZE,
+                offset=offset,
+                include=["embeddings", "documents", "metadatas"]
+            )
+            ids.extend(page["ids"])
+            documents.extend(page["documents"])
+            metadatas.extend(page["metadatas"])
+            vectors.append(np.asarray(page["embeddings"], dtype=np.float32))
+        return {
+            "embedder": embedder,
+            "ids": ids,
+            "documents": documents,
+            "metadatas": metadatas,
+            "vectors": np.vstack(vectors) if vectors else np.zeros((0, embedder.dim), dtype=np.float32)
+        }
+    except Exception as e:
+        logger.error(f"Error exporting index for user {user_id}: {str(e)}")
+        return None
+
+def import_user_index(user_id, embedder, ids, documents, metadatas, vectors):
+    """Replace a user's index with items that are already embedded.
+
+    Nothing is re-embedded: the vectors are stored as they are and
+    ``embedder`` (the model that produced them) becomes the user's
+    embedder, so later syncs diff against the imported items as usual.
+    """
+    try:
+        if not user_id:
+            logger.error("No user ID provided")
+            return False
+        if len(ids) != len(vectors) or (len(ids) and vectors.shape[1] != embedder.dim):
+            logger.error(f"Vectors do not match {len(ids)} items of width {embedder.dim}")
+            return False
+
+        started = time.time()
+        collection_name = get_user_collection_name(user_id)
+        _sync_user_cache(collection_name, force=True)
+        metadatas = [{**metadata, "user_id": user_id} for metadata in metadatas]
+        tenant_dir = get_tenant_dir(user_id)
+        # Later syncs find the imported vectors in the cache
+        embedding_cache.put_many(embedder.version, documents, vectors)
+
+        use_exact = len(ids) <= EXACT_INDEX_MAX_ITEMS
+        if use_exact:
+            ExactIndex(ids, documents, metadatas, vectors).save(tenant_dir)
+            with _exact_lock:
+                _exact_indexes[collection_name] = ExactIndex.load(tenant_dir)
+        else:
+            client = get_user_client(user_id)
+            try:
+                client.delete_collection(collection_name)
+            except Exception:
+                pass
+            collection = _open_collection(user_id)
+            for start in range(0, len(ids), INGEST_BATCH_SIZE):
+                end = start + INGEST_BATCH_SIZE
+                collection.add(
+                    ids=list(ids[start:end]),
+                    embeddings=np.asarray(vectors[start:end], dtype=np.float32).tolist(),
+                    documents=list(documents[start:end]),
+                    metadatas=metadatas[start:end]
+                )
+            with _exact_lock:
+                _exact_indexes[collection_name] = None
+
+        save_user_embedder(embedder, user_id)
+        content_types = [metadata.get("content_type") for metadata in metadatas]
+        save_user_bm25(BM25Index.build(ids, documents, content_types), user_id)
+
+        invalidate_user_cache(user_id)
+        if use_exact:
+            try:
+                get_user_client(user_id).delete_collection(collection_name)
+            except Exception:
+                pass
+        else:
+            ExactIndex.remove(tenant_dir)
+        invalidate_user_cache(user_id)
+        _record_access(collection_name)
+        logger.info(f"Imported {len(ids)} items for user {user_id} in {time.time() - started:.2f}s")
+        return True
+
+    except Exception as e:
+        logger.error(f"Error importing index for user {user_id}: {str(e)}")
+        return False
+
 def delete_user_data(user_id):
     """Delete all data for a specific user from ChromaDB."""
     try:
@@ -213,14 +1442,31 @@ def delete_user_data(user_id):
             return False
 
         collection_name = get_user_collection_name(user_id)
+        with _embedders_lock:
+            _embedders.pop(collection_name, None)
+        with _bm25_lock:
+            _bm25_indexes.pop(collection_name, None)
+        with _exact_lock:
+            _exact_indexes.pop(collection_name, None)
+        invalidate_user_cache(user_id)
+        tenant_dir = get_tenant_dir(user_id)
+        had_exact_index = ExactIndex.exists(tenant_dir)
+        shutil.rmtree(tenant_dir, ignore_errors=True)
+        client = get_user_client(user_id)
+        shard_map.forget(collection_name)
+        residency.remove(collection_name)
+        _last_access.pop(collection_name, None)
         try:
-            chroma_client.delete_collection(collection_name)
+            client.delete_collection(collection_name)
             logger.info(f"Successfully deleted collection for user {user_id}")
             return True
         except Exception as e:
+            if had_exact_index:
+                logger.info(f"Successfully deleted exact index for user {user_id}")
+                return True
             logger.error(f"Error deleting collection for user {user_id}: {str(e)}")
             return False
             
     except Exception as e:
         logger.error(f"Error in delete_user_data: {str(e)}")
-        return False 
\ No newline at end of file
+        return False
@@ -0,0 +1,96 @@
+import re
+
+# Same keys as DataProcessor.get_content_type_options
+CONTENT_TYPES = ('products', 'services', 'contact', 'about', 'faq', 'policies', 'general')
+
+# Longest string kept in a metadata value; the full item lives in the document
+METADATA_MAX_CHARS = 256
+
+PRICE_PATTERN = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+# Fields whose presence identifies an item's content type, checked in order
+_ITEM_SIGNATURES = [
+    ('faq', ('question', 'answer')),
+    ('policies', ('lastUpdated', 'version')),
+    ('contact', ('email', 'phone', 'address', 'hours', 'socialMedia', 'contactPerson')),
+    ('about', ('companyName', 'mission', 'vision', 'history', 'values')),
+    ('services', ('duration',)),
+    ('products', ('price', 'sku', 'imageUrl', 'availability')),
+]
+
+# Question keywords and the content types that can answer them
+_QUESTION_ROUTES = [
+    (re.compile(r"\b(price|prices|cost|costs|how much|rate|rates|cheap|expensive|rs\.?|inr)\b|₹"),
+     ('products', 'services')),
+    (re.compile(r"\b(phone|call|email|e-mail|address|located|location|where are you|contact|whatsapp|instagram|hours|timings?|open|close|closing)\b"),
+     ('contact', 'faq')),
+    (re.compile(r"\b(refund|refunds|return|returns|cancel|cancellation|policy|policies|privacy|terms)\b"),
+     ('policies', 'faq')),
+    (re.compile(r"\b(who are you|about you|founded|founder|owner|history|story|mission|vision)\b"),
+     ('about',)),
+]
+
+def classify_item(item):
+    """Infer the content type of an extracted item from its fields."""
+    if not isinstance(item, dict):
+        return 'general'
+    declared = item.get('content_type')
+    if declared in CONTENT_TYPES:
+        return declared
+    if 'title' in item and 'content' in item:
+        return 'policies'
+    for content_type, fields in _ITEM_SIGNATURES:
+        if any(field in item for field in fields):
+            return content_type
+    return 'general'
+
+def classify_question(text):
+    """Content types a question should be answered from, or None for all.
+
+    A cheap keyword router: only clear-cut questions (prices, contact
+    details, policies, company background) are narrowed down.
+    """
+    lowered = text.lower()
+    matched = []
+    for pattern, content_types in _QUESTION_ROUTES:
+        if pattern.search(lowered):
+            matched.extend(t for t in content_types if t not in matched)
+    return matched or None
+
+def _scalar(value):
+    if isinstance(value, bool) or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        return value[:METADATA_MAX_CHARS]
+    if isinstance(value, list) and all(isinstance(v, (str, int, float, bool)) for v in value):
+        return ", ".join(str(v) for v in value)[:METADATA_MAX_CHARS]
+    return None
+
+def project_metadata(item, prefix=""):
+    """Flatten an item into ChromaDB-compatible, typed metadata.
+
+    Nested objects become dotted keys, lists of scalars are joined into
+    one string, long strings are truncated and anything else (such as
+    lists of objects) is left to the document. A numeric ``price_value``
+    is added when the price can be parsed.
+    """
+    metadata = {}
+    if not isinstance(item, dict):
+        return metadata
+    for key, value in item.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metadata.update(project_metadata(value, prefix=f"{name}."))
+            continue
+        scalar = _scalar(value)
+        if scalar is not None:
+            metadata[name] = scalar
+
+    if not prefix and isinstance(item.get('price'), (str, int, float)):
+        match = PRICE_PATTERN.search(str(item['price']))
+        if match:
+            try:
+                metadata['price_value'] = float(match.group(0).replace(",", ""))
+            except ValueError:
+                pass
+    return metadata
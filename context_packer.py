@@ -0,0 +1,144 @@
+import json
+import os
+import re
+
+# Upper bound on the estimated tokens of context put into a prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Longest descriptive value kept in a context card; longer ones are cut at a word
+CONTEXT_CARD_FIELD_CHARS = int(os.getenv("CONTEXT_CARD_FIELD_CHARS", "300"))
+
+# Marketing copy a card may shorten; answers, policy content and other
+# fields that carry the substance of an item are always kept whole
+CARD_TRUNCATED_FIELDS = ('description', 'short_description', 'long_description', 'features', 'specifications')
+
+# Bookkeeping fields that mean nothing to the model
+INTERNAL_FIELDS = {
+    'stored_at', 'user_id', 'content_hash', 'content_type', 'price_value', 'parent_id',
+    'passage_field', 'passage_index', 'passage_count', 'passage_start', 'context_card'
+}
+
+# Fields rendered first, in this order, so each line starts with what the item is
+LEAD_FIELDS = ('name', 'title', 'question', 'answer', 'price')
+
+_TOKEN_PIECES = re.compile(r"[A-Za-z]+|\d+|\S")
+_SPACES = re.compile(r"\s+")
+
+def estimate_tokens(text):
+    """Cheap local estimate of how many model tokens a text takes.
+
+    Words count one token per six letters started, digit runs one per
+    three digits and any other symbol one each, which errs on the high
+    side of what Gemini's tokenizer reports for catalog text.
+    """
+    count = 0
+    for piece in _TOKEN_PIECES.findall(text):
+        if piece[0].isdigit():
+            count += 1 + (len(piece) - 1) // 3
+        elif piece[0].isascii() and piece[0].isalpha():
+            count += 1 + (len(piece) - 1) // 6
+        else:
+            count += 1
+    return count
+
+def _flatten(value, prefix, fields):
+    if isinstance(value, dict):
+        for key, inner in value.items():
+            _flatten(inner, f"{prefix}.{key}" if prefix else str(key), fields)
+    elif isinstance(value, list):
+        if all(isinstance(v, (str, int, float, bool)) for v in value):
+            fields.append((prefix, ", ".join(str(v) for v in value)))
+        else:
+            fields.append((prefix, json.dumps(value, ensure_ascii=False, separators=(",", ":"))))
+    elif value is not None and value != "":
+        fields.append((prefix, str(value)))
+
+def _truncate(value, max_chars):
+    if len(value) <= max_chars:
+        return value
+    cut = value[:max_chars].rsplit(" ", 1)[0] or value[:max_chars]
+    return cut.rstrip(" ,;.") + "…"
+
+def render_item(document, metadata=None, max_chars=None, truncate=()):
+    """One context line for a retrieved item.
+
+    Fields come from the document; metadata only adds what the document
+    does not already say, minus internal bookkeeping fields. With
+    ``max_chars``, values of the fields named in ``truncate`` (matched on
+    the last part of a dotted name) are cut to that length.
+    """
+    fields = []
+    try:
+        parsed = json.loads(document)
+    except (TypeError, ValueError):
+        parsed = None
+    if isinstance(parsed, dict):
+        _flatten({k: v for k, v in parsed.items() if k not in INTERNAL_FIELDS}, "", fields)
+    elif document:
+        fields.append(("", document))
+
+    lead = {field: i for i, field in enumerate(LEAD_FIELDS)}
+    fields.sort(key=lambda field: lead.get(field[0], len(lead)))
+    known = {name for name, _ in fields}
+    for key, value in (metadata or {}).items():
+        if key in INTERNAL_FIELDS or key in known:
+            continue
+        if isinstance(parsed, dict) and key.split(".")[0] in parsed:
+            continue
+        fields.append((key, str(value)))
+
+    if max_chars and truncate:
+        fields = [
+            (name, _truncate(value, max_chars) if name.rsplit(".", 1)[-1] in truncate else value)
+            for name, value in fields
+        ]
+    parts = [
+        _SPACES.sub(" ", f"{name}: {value}" if name else value).strip()
+        for name, value in fields
+    ]
+    content_type = (metadata or {}).get('content_type')
+    line = " | ".join(part for part in parts if part)
+    return f"- [{content_type}] {line}" if content_type and line else (f"- {line}" if line else "")
+
+def build_card(document, metadata=None):
+    """Prompt-ready context card for an item, computed once at ingest.
+
+    A card is the item's context line with descriptive fields (see
+    CARD_TRUNCATED_FIELDS) truncated to CONTEXT_CARD_FIELD_CHARS; a
+    passage keeps its passage text whole.
+    """
+    passage_field = (metadata or {}).get('passage_field')
+    truncate = tuple(field for field in CARD_TRUNCATED_FIELDS if field != passage_field)
+    return render_item(document, metadata, max_chars=CONTEXT_CARD_FIELD_CHARS, truncate=truncate)
+
+def pack_context(results, budget=None):
+    """Pack query results into compact context lines within a token budget.
+
+    Items stored with a context card (see build_card) use it as is;
+    others are rendered from their document. Items are taken in rank
+    order and repeated lines are skipped. The
+    first item is truncated if it alone exceeds the budget; later items
+    that do not fit are skipped, so smaller ones further down can still
+    fill the remaining budget. Returns ``(context, tokens, items)``.
+    """
+    budget = budget or CONTEXT_TOKEN_BUDGET
+    documents = results['documents'][0] if results and results.get('documents') else []
+    metadatas = results['metadatas'][0] if results and results.get('metadatas') else [None] * len(documents)
+    lines = []
+    seen = set()
+    used = 0
+    for document, metadata in zip(documents, metadatas):
+        line = (metadata or {}).get('context_card') or render_item(document, metadata)
+        if not line or line in seen:
+            continue
+        tokens = estimate_tokens(line) + 1
+        if used + tokens > budget:
+            if lines:
+                continue
+            # Keep a proportional prefix of a single oversized item
+            line = line[:max(1, len(line) * budget // tokens)]
+            tokens = estimate_tokens(line) + 1
+        seen.add(line)
+        lines.append(line)
+        used += tokens
+    return "\n".join(lines), used, len(lines)
@@ -1128,7 +1128,7 @@ function sendMessage() {
     }
     
     console.log('Using user ID for chat:', userId);
-    console.log('Sending request to:', `${BACKEND_URL}/api/chat`);
+    console.log('Sending request to:', `${BACKEND_URL}/api/chat/stream`);
     
     const requestBody = { 
         message,
@@ -1136,8 +1136,10 @@ function sendMessage() {
     };
     console.log('Request body:', requestBody);
     
-    // Send message to backend
-    fetch(`${BACKEND_URL}/api/chat`, {
+    // Stream the reply so it shows up as Gemini writes it
+    let botMessage = null;
+    let streamedText = '';
+    fetch(`${BACKEND_URL}/api/chat/stream`, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
@@ -1146,52 +1148,29 @@ function sendMessage() {
     })
     .then(response => {
         console.log('Response status:', response.status);
-        console.log('Response headers:', response.headers);
         if (!response.ok) {
             return response.json().then(data => {
                 console.log('Error response data:', data);
                 throw new Error(data.error || `HTTP error! status: ${response.status}`);
             });
         }
-        return response.json();
-    })
-    .then(data => {
-        console.log('Success response data:', data);
-        // Remove typing indicator
-        removeTypingIndicator();
-        
-        // Add bot response
-        if (data.error) {
-            console.log('Response contains error:', data.error);
-            if (data.error.includes("GEMINI_API_KEY")) {
-                addMessage("Hi there! I'm having some technical difficulties right now. Please contact our support team to get me back up and running so I can help you with your bakery questions! 🍰", 'bot');
-            } else if (data.error.includes("Failed to retrieve context")) {
-                addMessage(data.error, 'bot');
-                addMessage("To get started:\n1. Upload your bakery's product data using the 'Upload Data' section\n2. Click 'Store in Database' button in the data table\n3. Then I'll be able to answer all your questions about our delicious treats! 🍰", 'bot');
-            } else {
-                addMessage(`Oops! I encountered an issue: ${data.error}. Don't worry, I'm here to help once we get this sorted! 😊`, 'bot');
-            }
-        } else if (data.response.includes("I don't have enough context") || data.response.includes("I couldn't find any relevant information")) {
-            // If no data in ChromaDB, provide helpful message
-            addMessage(data.response, 'bot');
-            addMessage("To get started:\n1. Upload your bakery's product data using the 'Upload Data' section\n2. Click 'Store in Database' button in the data table\n3. Then I'll be able to answer all your questions about our delicious treats! 🍰", 'bot');
-        } else {
-            // Format the response for better readability
-            const formattedResponse = data.response
-                .replace(/\n\n/g, '\n') // Remove double newlines
-                .replace(/\n/g, '<br>') // Convert newlines to HTML breaks
-                .replace(/\d+\.\s/g, '<br><strong>$&</strong>') // Format numbered lists
-                .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>') // Format bold text
-                .replace(/\*(.*?)\*/g, '<em>$1</em>'); // Format italic text
-                
-            addMessage(formattedResponse, 'bot');
-            
-            // If the response contains metrics or insights, add a suggestion
-            if (data.response.includes("$") || data.response.includes("%") || 
-                data.response.includes("metric") || data.response.includes("insight")) {
-                addMessage("Would you like me to tell you more about any of our products or help you find something specific? I'm here to help! 😊", 'bot');
+        return readChatStream(response, (event, data) => {
+            if (event === 'token') {
+                streamedText += data.text;
+                if (!botMessage) {
+                    // First piece of the reply replaces the typing indicator
+                    removeTypingIndicator();
+                    botMessage = addMessage(formatBotResponse(streamedText), 'bot');
+                } else {
+                    setMessageText(botMessage, formatBotResponse(streamedText));
+                }
+            } else if (event === 'error') {
+                throw new Error(data.error);
+            } else if (event === 'done') {
+                console.log('Success response data:', data);
+                showChatResponse(data, botMessage);
             }
-        }
+        });
     })
     .catch(error => {
         console.error('=== FETCH ERROR ===');
@@ -1203,6 +1182,73 @@ function sendMessage() {
     });
 }
 
+// Read a Server-Sent Events response, calling onEvent(event, data) for each
+// message; EventSource cannot be used since the chat stream is a POST
+async function readChatStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = 'message';
+            let data = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            });
+            if (data) {
+                onEvent(event, JSON.parse(data));
+            }
+        }
+        if (done) {
+            return;
+        }
+    }
+}
+
+// Tidy a bot reply before addMessage formats it
+function formatBotResponse(text) {
+    return text
+        .replace(/\n\n/g, '\n') // Remove double newlines
+        .replace(/\n/g, '<br>') // Convert newlines to HTML breaks
+        .replace(/\d+\.\s/g, '<br><strong>$&</strong>') // Format numbered lists
+        .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>') // Format bold text
+        .replace(/\*(.*?)\*/g, '<em>$1</em>'); // Format italic text
+}
+
+// Show the finished reply, plus the hints that go with it
+function showChatResponse(data, botMessage) {
+    removeTypingIndicator();
+    if (data.response.includes("I don't have enough context") || data.response.includes("I couldn't find any relevant information")) {
+        // If no data in ChromaDB, provide helpful message
+        if (!botMessage) {
+            addMessage(data.response, 'bot');
+        }
+        addMessage("To get started:\n1. Upload your bakery's product data using the 'Upload Data' section\n2. Click 'Store in Database' button in the data table\n3. Then I'll be able to answer all your questions about our delicious treats! 🍰", 'bot');
+        return;
+    }
+    
+    if (botMessage) {
+        setMessageText(botMessage, formatBotResponse(data.response));
+    } else {
+        addMessage(formatBotResponse(data.response), 'bot');
+    }
+    
+    // If the response contains metrics or insights, add a suggestion
+    if (data.response.includes("$") || data.response.includes("%") || 
+        data.response.includes("metric") || data.response.includes("insight")) {
+        addMessage("Would you like me to tell you more about any of our products or help you find something specific? I'm here to help! 😊", 'bot');
+    }
+}
+
 function addMessage(text, type) {
     const chatMessages = document.getElementById('chatMessages');
     const messageDiv = document.createElement('div');
@@ -1219,21 +1265,8 @@ function addMessage(text, type) {
     const contentDiv = document.createElement('div');
     contentDiv.className = 'message-content';
     
-    // Process the text to handle line breaks and formatting
-    let processedText = text
-        .replace(/\n\n/g, '</p><p>') // Convert double newlines to paragraph breaks
-        .replace(/\n/g, '<br>') // Convert single newlines to line breaks
-        .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>') // Format bold text
-        .replace(/\*(.*?)\*/g, '<em>$1</em>') // Format italic text
-        .replace(/\d+\.\s/g, '<br><strong>$&</strong>'); // Format numbered lists
-    
-    // Wrap in paragraph tags if not already wrapped
-    if (!processedText.startsWith('<p>') && !processedText.startsWith('<ul>')) {
-        processedText = `<p>${processedText}</p>`;
-    }
-    
     // Set content with strict containment
-    contentDiv.innerHTML = processedText;
+    contentDiv.innerHTML = formatMessageHtml(text);
     contentDiv.style.maxWidth = '100%';
     contentDiv.style.overflow = 'hidden';
     contentDiv.style.wordWrap = 'break-word';
@@ -1264,6 +1297,29 @@ function addMessage(text, type) {
     return messageDiv;
 }
 
+// Process the text to handle line breaks and formatting
+function formatMessageHtml(text) {
+    let processedText = text
+        .replace(/\n\n/g, '</p><p>') // Convert double newlines to paragraph breaks
+        .replace(/\n/g, '<br>') // Convert single newlines to line breaks
+        .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>') // Format bold text
+        .replace(/\*(.*?)\*/g, '<em>$1</em>') // Format italic text
+        .replace(/\d+\.\s/g, '<br><strong>$&</strong>'); // Format numbered lists
+    
+    // Wrap in paragraph tags if not already wrapped
+    if (!processedText.startsWith('<p>') && !processedText.startsWith('<ul>')) {
+        processedText = `<p>${processedText}</p>`;
+    }
+    return processedText;
+}
+
+// Replace the text of a message added with addMessage, e.g. while it streams in
+function setMessageText(messageDiv, text) {
+    messageDiv.querySelector('.message-content').innerHTML = formatMessageHtml(text);
+    const chatMessages = document.getElementById('chatMessages');
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
 // Analytics Functions
 function getInsights() {
     const query = document.getElementById('insightQuery').value;
@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of embeddings kept in the in-memory LRU
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+
+# Maximum number of embeddings kept on disk; the oldest are removed beyond it
+EMBEDDING_CACHE_DISK_SIZE = int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", "200000"))
+
+# Keys per SELECT when reading a batch back from SQLite
+_SQLITE_BATCH = 500
+
+# Rows written between checks of the on-disk size cap
+_PRUNE_INTERVAL = 5000
+
+def content_digest(model_version, text):
+    """Stable digest of a text under a given embedding model version."""
+    digest = hashlib.sha256()
+    digest.update(model_version.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+class EmbeddingCache:
+    """Content-addressed embedding cache.
+
+    An in-memory LRU sits in front of a SQLite table that survives
+    restarts. Entries are keyed by the digest of the text and the
+    embedding model version, so refitting a model never serves stale
+    vectors. Rows of a model that is replaced are deleted with
+    ``retire_version``, and the table is capped at ``max_disk_entries``
+    rows, dropping the oldest first.
+    """
+
+    def __init__(self, path, max_entries=EMBEDDING_CACHE_SIZE, max_disk_entries=EMBEDDING_CACHE_DISK_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            # Caches written before rows recorded their model and age
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(embeddings)")}
+            if "version" not in columns:
+                conn.execute("ALTER TABLE embeddings ADD COLUMN version TEXT NOT NULL DEFAULT ''")
+            if "created_at" not in columns:
+                conn.execute("ALTER TABLE embeddings ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_version ON embeddings (version)")
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_created_at ON embeddings (created_at)")
+            conn.commit()
+            self._conn = conn
+            self._prune(conn)
+        return self._conn
+
+    def _prune(self, conn):
+        """Delete the oldest rows beyond ``max_disk_entries``."""
+        (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY created_at LIMIT ?)", (excess,)
+            )
+            conn.commit()
+            logger.info(f"Pruned {excess} old embeddings from the cache")
+        self._writes = 0
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model_version, texts):
+        """Look up texts; returns a list with a vector or None per text."""
+        keys = [content_digest(model_version, text) for text in texts]
+        found = [None] * len(keys)
+        missing = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[i] = vector
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing:
+                try:
+                    conn = self._connection()
+                    pending = list(missing)
+                    for start in range(0, len(pending), _SQLITE_BATCH):
+                        batch = pending[start:start + _SQLITE_BATCH]
+                        placeholders = ",".join("?" * len(batch))
+                        rows = conn.execute(
+                            f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                            batch
+                        ).fetchall()
+                        for key, blob in rows:
+                            vector = np.frombuffer(blob, dtype=np.float32)
+                            self._remember(key, vector)
+                            for i in missing[key]:
+                                found[i] = vector
+                            self.disk_hits += len(missing[key])
+                except Exception as e:
+                    logger.error(f"Error reading embedding cache: {str(e)}")
+
+            hits = sum(vector is not None for vector in found)
+            self.hits += hits
+            self.misses += len(found) - hits
+        return found
+
+    def put_many(self, model_version, texts, vectors, persist=True):
+        """Store vectors for texts; ``persist=False`` keeps them in memory only."""
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                key = content_digest(model_version, text)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+
+            if persist and rows:
+                try:
+                    conn = self._connection()
+                    now = time.time()
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector, version, created_at) VALUES (?, ?, ?, ?)",
+                        [(key, blob, model_version, now) for key, blob in rows]
+                    )
+                    conn.commit()
+                    self._writes += len(rows)
+                    if self._writes >= _PRUNE_INTERVAL:
+                        self._prune(conn)
+                except Exception as e:
+                    logger.error(f"Error writing embedding cache: {str(e)}")
+
+    def retire_version(self, model_version):
+        """Delete every stored embedding of a model that is no longer used."""
+        with self._lock:
+            try:
+                conn = self._connection()
+                deleted = conn.execute("DELETE FROM embeddings WHERE version = ?", (model_version,)).rowcount
+                conn.commit()
+                if deleted:
+                    logger.info(f"Removed {deleted} cached embeddings of retired model {model_version}")
+            except Exception as e:
+                logger.error(f"Error pruning embedding cache: {str(e)}")
+
+    def stats(self):
+        """Hit/miss counters and current in-memory size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory)
+            }
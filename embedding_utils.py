@@ -0,0 +1,120 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+logger = logging.getLogger(__name__)
+
+# Dimension of embeddings produced by a fitted tenant embedder
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "512"))
+
+# Words of two or more characters starting with a letter; bare numbers such
+# as prices and SKUs would otherwise crowd real terms out of the vocabulary
+TOKEN_REGEX = r"(?u)\b[^\W\d_]\w+\b"
+TOKEN_PATTERN = re.compile(TOKEN_REGEX)
+
+EMBEDDER_FILENAME = "embedder.json"
+
+def fold_plural(word):
+    """Trim a plural "s" so "brownies" and "brownie" are the same term.
+
+    Short words, "ss" endings and anything containing a digit ("500s",
+    "2kgs") are left alone.
+    """
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss") and not any(c.isdigit() for c in word):
+        return word[:-1]
+    return word
+
+def folded_tokens(text):
+    """Embedder tokens of already lower-cased text, with plurals folded."""
+    return [fold_plural(token) for token in TOKEN_PATTERN.findall(text)]
+
+class TenantEmbedder:
+    """TF-IDF embedder fitted once on a tenant's corpus.
+
+    Fitting happens at ingest time only. After that the embedder is
+    read-only: ``transform`` touches no shared state, so concurrent
+    request threads can use the same instance without locking.
+
+    Fitted embedders fold plurals at fit and transform time. Embedders
+    saved before folding existed keep tokenizing as they did, so their
+    stored vectors stay comparable with new queries until the next refit.
+    """
+
+    def __init__(self, vocabulary, idf, dim=None, fold_plurals=False):
+        self.vocabulary = {term: int(index) for term, index in vocabulary.items()}
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.dim = dim or len(self.idf)
+        self.fold_plurals = fold_plurals
+        self.version = self._compute_version()
+
+    def _compute_version(self):
+        digest = hashlib.sha1()
+        digest.update(json.dumps(self.vocabulary, sort_keys=True).encode("utf-8"))
+        digest.update(self.idf.tobytes())
+        digest.update(str(self.dim).encode("utf-8"))
+        if self.fold_plurals:
+            digest.update(b"fold_plurals")
+        return digest.hexdigest()[:16]
+
+    @classmethod
+    def fit(cls, texts, dim=EMBEDDING_DIM):
+        """Fit vocabulary and IDF statistics on a whole corpus."""
+        tfidf = TfidfVectorizer(max_features=dim, tokenizer=folded_tokens, token_pattern=None)
+        tfidf.fit(texts)
+        return cls(tfidf.vocabulary_, tfidf.idf_, dim=dim, fold_plurals=True)
+
+    @classmethod
+    def from_vocabulary(cls, terms):
+        """Build an unfitted embedder over a fixed term list (uniform IDF)."""
+        return cls(dict(zip(terms, range(len(terms)))), np.ones(len(terms)))
+
+    def transform(self, texts):
+        """Embed texts as an L2-normalised float32 matrix."""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        vocabulary = self.vocabulary
+        tokenizer = folded_tokens if self.fold_plurals else TOKEN_PATTERN.findall
+        for row, text in enumerate(texts):
+            for token in tokenizer(text.lower()):
+                index = vocabulary.get(token)
+                if index is not None:
+                    matrix[row, index] += 1.0
+        matrix[:, :len(self.idf)] *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def to_dict(self):
+        """JSON-serialisable state: vocabulary, IDF statistics and width."""
+        return {
+            "version": self.version,
+            "dim": self.dim,
+            "fold_plurals": self.fold_plurals,
+            "vocabulary": self.vocabulary,
+            "idf": self.idf.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        """Rebuild an embedder from ``to_dict`` output."""
+        return cls(state["vocabulary"], state["idf"], dim=state["dim"],
+                   fold_plurals=state.get("fold_plurals", False))
+
+    def save(self, path):
+        """Persist vocabulary and IDF statistics as JSON."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a persisted embedder, or return None if there is none."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,260 @@
+import json
+import logging
+import os
+import shutil
+import uuid
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EXACT_INDEX_DIRNAME = "exact"
+VECTORS_FILENAME = "vectors.npy"
+ITEMS_FILENAME = "items.json"
+CURRENT_FILENAME = "CURRENT"
+QUANTIZED_FILENAME = "quantized.npy"
+SCALES_FILENAME = "scales.npy"
+
+# How vectors are held for search: "none" (float32), "float16" or "int8"
+EXACT_INDEX_QUANTIZATION = os.getenv("EXACT_INDEX_QUANTIZATION", "none").lower()
+
+# Quantized search re-scores this many candidates per requested result
+# against the float32 vectors, which are then kept on disk next to the
+# quantized copy (0 returns quantized scores and stores only the quantized copy)
+EXACT_INDEX_RERANK = int(os.getenv("EXACT_INDEX_RERANK", "4"))
+
+# Quantized rows are widened to float32 this many at a time while scoring,
+# so the temporary copy stays cache-sized instead of matching the matrix
+SCORE_BLOCK_ROWS = 256
+
+def quantize(vectors, mode):
+    """Quantize row vectors to float16, or to int8 with one scale per row.
+
+    Returns ``(quantized, scales)``; ``scales`` is None for float16.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if mode == "float16":
+        return vectors.astype(np.float16), None
+    if mode == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+    raise ValueError(f"Unknown quantization: {mode}")
+
+class ExactIndex:
+    """Exact top-k search over one tenant's vectors held in a single matrix.
+
+    Meant for small tenants, where a brute-force dot product over a
+    contiguous float32 matrix beats an HNSW graph on both latency and
+    footprint. It exposes the subset of the ChromaDB collection API that
+    retrieval uses (``query``, ``get``, ``count``), so callers can treat
+    both backends the same way.
+
+    With ``quantization`` set to "float16" or "int8" the search runs over
+    a quantized copy of the matrix, widened block by block as it is
+    scored, and the best candidates are re-scored against the float32
+    vectors (see EXACT_INDEX_RERANK). Only those candidate rows of the
+    memory-mapped float32 file are ever read. Without re-scoring the
+    float32 vectors are dropped, so they take neither memory nor disk.
+    """
+
+    def __init__(self, ids, documents, metadatas, vectors, quantization=None,
+                 quantized=None, scales=None, rerank=None):
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.metadatas = list(metadatas)
+        self.vectors = vectors
+        self.quantization = quantization or EXACT_INDEX_QUANTIZATION
+        self.rerank = EXACT_INDEX_RERANK if rerank is None else rerank
+        if self.quantization != "none" and quantized is None:
+            quantized, scales = quantize(vectors, self.quantization)
+        self.quantized = quantized
+        self.scales = scales
+        if self.quantized is not None and (self.rerank <= 0 or self.vectors is None):
+            self.rerank = 0
+            self.vectors = None
+        self._positions = {item_id: i for i, item_id in enumerate(self.ids)}
+        self._masks = {}
+
+    def count(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """Bytes of the matrix that every search scans."""
+        if self.quantized is None:
+            return self.vectors.nbytes
+        return self.quantized.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def dense_vectors(self):
+        """Float32 vectors, rebuilt from the quantized copy if they were not kept."""
+        if self.vectors is not None:
+            return self.vectors
+        vectors = self.quantized.astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[:, None]
+        return vectors
+
+    def _where_mask(self, where):
+        """Boolean row mask for a ChromaDB-style ``where`` filter.
+
+        Supports what retrieval needs: ``{field: value}``,
+        ``{field: {"$eq": value}}`` and ``{field: {"$in": [...]}}``.
+        """
+        key = json.dumps(where, sort_keys=True)
+        if key in self._masks:
+            return self._masks[key]
+
+        mask = np.ones(len(self.ids), dtype=bool)
+        for field, condition in where.items():
+            if isinstance(condition, dict):
+                if "$in" in condition:
+                    allowed = set(condition["$in"])
+                else:
+                    allowed = {condition.get("$eq")}
+            else:
+                allowed = {condition}
+            mask &= np.array([m.get(field) in allowed for m in self.metadatas], dtype=bool)
+        self._masks[key] = mask
+        return mask
+
+    def _scores(self, query_vectors):
+        if self.quantized is None:
+            return query_vectors @ self.vectors.T
+        rows = len(self.quantized)
+        scores = np.empty((len(query_vectors), rows), dtype=np.float32)
+        block = np.empty((min(SCORE_BLOCK_ROWS, rows), self.quantized.shape[1]), dtype=np.float32)
+        for start in range(0, rows, SCORE_BLOCK_ROWS):
+            end = min(start + SCORE_BLOCK_ROWS, rows)
+            widened = block[:end - start]
+            np.copyto(widened, self.quantized[start:end], casting="unsafe")
+            np.matmul(query_vectors, widened.T, out=scores[:, start:end])
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def top_k(self, query_vectors, k, where=None):
+        """Indices and cosine scores of the ``k`` best rows per query."""
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        if self.quantized is not None and self.rerank > 0:
+            candidates, _ = self._top_k(self._scores(query_vectors), k * self.rerank, where)
+            if candidates.shape[1] == 0:
+                return candidates, np.zeros(candidates.shape, dtype=np.float32)
+            # Exact scores for the shortlisted rows only
+            rows = np.asarray(self.vectors[candidates], dtype=np.float32)
+            exact = np.einsum("qcd,qd->qc", rows, query_vectors)
+            k = min(k, candidates.shape[1])
+            order = np.argsort(-exact, axis=1)[:, :k]
+            return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(exact, order, axis=1)
+        return self._top_k(self._scores(query_vectors), k, where)
+
+    def _top_k(self, scores, k, where):
+        if where:
+            mask = self._where_mask(where)
+            scores[:, ~mask] = -np.inf
+            k = min(k, int(mask.sum()))
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return np.zeros((len(scores), 0), dtype=np.int64), np.zeros((len(scores), 0), dtype=np.float32)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def query(self, query_embeddings, n_results=10, where=None,
+              include=("documents", "metadatas", "distances")):
+        """ChromaDB-style query; distances are squared L2 (2 - 2cos)."""
+        indices, scores = self.top_k(query_embeddings, n_results, where=where)
+        return {
+            "ids": [[self.ids[i] for i in row] for row in indices],
+            "documents": [[self.documents[i] for i in row] for row in indices],
+            "metadatas": [[self.metadatas[i] for i in row] for row in indices],
+            "distances": [[float(2.0 - 2.0 * score) for score in row] for row in scores]
+        }
+
+    def get(self, ids=None, include=("documents", "metadatas")):
+        """ChromaDB-style get by ID; unknown IDs are skipped."""
+        positions = range(len(self.ids)) if ids is None else [
+            self._positions[item_id] for item_id in ids if item_id in self._positions
+        ]
+        return {
+            "ids": [self.ids[i] for i in positions],
+            "documents": [self.documents[i] for i in positions],
+            "metadatas": [self.metadatas[i] for i in positions]
+        }
+
+    def save(self, tenant_dir):
+        """Write the index into a new version directory and point CURRENT at it.
+
+        Older versions are removed on a best-effort basis; one that is still
+        memory-mapped by a reader is left for the next save to clean up.
+        """
+        root = os.path.join(tenant_dir, EXACT_INDEX_DIRNAME)
+        version = uuid.uuid4().hex[:12]
+        target = os.path.join(root, version)
+        os.makedirs(target)
+        vectors_path = os.path.join(target, VECTORS_FILENAME)
+        if self.vectors is not None:
+            np.save(vectors_path, np.ascontiguousarray(self.vectors, dtype=np.float32))
+            if self.quantized is not None:
+                # Searches only read re-scored rows, so let those page in on demand
+                self.vectors = np.load(vectors_path, mmap_mode="r")
+        if self.quantized is not None:
+            np.save(os.path.join(target, QUANTIZED_FILENAME), self.quantized)
+            if self.scales is not None:
+                np.save(os.path.join(target, SCALES_FILENAME), self.scales)
+        with open(os.path.join(target, ITEMS_FILENAME), "w", encoding="utf-8") as f:
+            json.dump({
+                "ids": self.ids,
+                "documents": self.documents,
+                "metadatas": self.metadatas
+            }, f, ensure_ascii=False)
+
+        pointer = os.path.join(root, CURRENT_FILENAME)
+        with open(f"{pointer}.tmp", "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(f"{pointer}.tmp", pointer)
+
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name != version and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, tenant_dir):
+        """Load an index with its vectors memory-mapped, or None if absent.
+
+        A quantized copy saved with the index is used as it is; otherwise
+        one is built if EXACT_INDEX_QUANTIZATION asks for it. An index
+        saved without its float32 vectors is always searched quantized.
+        """
+        root = os.path.join(tenant_dir, EXACT_INDEX_DIRNAME)
+        pointer = os.path.join(root, CURRENT_FILENAME)
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer, "r", encoding="utf-8") as f:
+            target = os.path.join(root, f.read().strip())
+        with open(os.path.join(target, ITEMS_FILENAME), "r", encoding="utf-8") as f:
+            items = json.load(f)
+        vectors_path = os.path.join(target, VECTORS_FILENAME)
+        vectors = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+        quantized = scales = None
+        quantization = EXACT_INDEX_QUANTIZATION
+        quantized_path = os.path.join(target, QUANTIZED_FILENAME)
+        if (quantization != "none" or vectors is None) and os.path.exists(quantized_path):
+            quantized = np.load(quantized_path, mmap_mode="r")
+            scales_path = os.path.join(target, SCALES_FILENAME)
+            scales = np.load(scales_path) if os.path.exists(scales_path) else None
+            quantization = "int8" if scales is not None else "float16"
+        return cls(items["ids"], items["documents"], items["metadatas"], vectors,
+                   quantization=quantization, quantized=quantized, scales=scales)
+
+    @staticmethod
+    def exists(tenant_dir):
+        """Whether a tenant has an exact index on disk."""
+        return os.path.exists(os.path.join(tenant_dir, EXACT_INDEX_DIRNAME, CURRENT_FILENAME))
+
+    @staticmethod
+    def remove(tenant_dir):
+        """Delete a tenant's exact index files, if any."""
+        shutil.rmtree(os.path.join(tenant_dir, EXACT_INDEX_DIRNAME), ignore_errors=True)
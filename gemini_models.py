@@ -0,0 +1,55 @@
+import json
+import logging
+import os
+import threading
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# Gemini model used for answers and extraction
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+class ModelRegistry:
+    """Configured Gemini models, built once and shared across threads.
+
+    A model object holds no per-request state, so one instance per
+    (model name, system instruction, generation config) serves every
+    request; only its first use pays for constructing it.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(self, name=None, system_instruction=None, generation_config=None):
+        """The shared model for this configuration, built on first use."""
+        name = name or GEMINI_MODEL
+        config_key = json.dumps(generation_config, sort_keys=True) if generation_config else None
+        key = (name, system_instruction, config_key)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                options = {}
+                if system_instruction:
+                    options["system_instruction"] = system_instruction
+                if generation_config:
+                    options["generation_config"] = generation_config
+                model = genai.GenerativeModel(name, **options)
+                self._models[key] = model
+                logger.info(f"Built Gemini model {name} ({len(self._models)} configurations cached)")
+        return model
+
+    def clear(self):
+        """Forget every model, e.g. after genai.configure is called with a new key."""
+        with self._lock:
+            self._models.clear()
+
+models = ModelRegistry()
+
+def get_model(name=None, system_instruction=None, generation_config=None):
+    """Shared model from the default registry; see ModelRegistry.get."""
+    return models.get(name, system_instruction, generation_config)
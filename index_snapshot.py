@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Portable snapshots of tenant vector indexes.
+
+A snapshot is one binary file: a short magic string, a JSON header with
+the embedder state, IDs, documents and metadata, and the float32 vector
+matrix, aligned so it can be memory-mapped in place. Importing one
+writes the vectors as they are, so moving a tenant to another node or
+shard, or warm-starting a node, never re-embeds anything.
+
+Usage:
+    python index_snapshot.py export USER_ID PATH
+    python index_snapshot.py import PATH [--user USER_ID]
+    python index_snapshot.py inspect PATH
+    python index_snapshot.py export-all DIR
+    python index_snapshot.py import-all DIR
+"""
+
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+import time
+import numpy as np
+from embedding_utils import TenantEmbedder
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"NXSNAP1\n"
+SNAPSHOT_SUFFIX = ".snap"
+
+# Vector data starts on a multiple of this many bytes
+_ALIGNMENT = 64
+
+def write_snapshot(path, user_id, embedder, ids, documents, metadatas, vectors):
+    """Write a tenant's index to ``path`` as a single snapshot file."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    header = json.dumps({
+        "format": 1,
+        "user_id": user_id,
+        "created_at": time.time(),
+        "count": len(ids),
+        "dim": int(vectors.shape[1]) if vectors.ndim == 2 else embedder.dim,
+        "dtype": "float32",
+        "embedder": embedder.to_dict(),
+        "ids": list(ids),
+        "documents": list(documents),
+        "metadatas": list(metadatas)
+    }, ensure_ascii=False).encode("utf-8")
+    prefix = len(SNAPSHOT_MAGIC) + 8 + len(header)
+    padding = -prefix % _ALIGNMENT
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<Q", len(header) + padding))
+        f.write(header)
+        f.write(b" " * padding)
+        f.write(vectors.tobytes())
+    os.replace(tmp_path, path)
+
+def read_snapshot(path):
+    """Read a snapshot, memory-mapping its vectors.
+
+    Returns a dict with ``user_id``, ``embedder``, ``ids``,
+    ``documents``, ``metadatas`` and ``vectors``.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not an index snapshot")
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size).decode("utf-8"))
+    offset = len(SNAPSHOT_MAGIC) + 8 + header_size
+
+    embedder = TenantEmbedder.from_dict(header["embedder"])
+    if embedder.version != header["embedder"]["version"]:
+        raise ValueError(f"Embedder in {path} does not match its recorded version")
+    shape = (header["count"], header["dim"])
+    if header["count"]:
+        vectors = np.memmap(path, dtype=np.float32, mode="r", offset=offset, shape=shape)
+    else:
+        vectors = np.zeros(shape, dtype=np.float32)
+    return {
+        "user_id": header["user_id"],
+        "created_at": header["created_at"],
+        "embedder": embedder,
+        "ids": header["ids"],
+        "documents": header["documents"],
+        "metadatas": header["metadatas"],
+        "vectors": vectors
+    }
+
+def export_tenant(user_id, path):
+    """Snapshot a tenant's current index to ``path``; False if they have none."""
+    from chroma_utils import export_user_index
+
+    exported = export_user_index(user_id)
+    if exported is None:
+        logger.error(f"No index to export for user {user_id}")
+        return False
+    write_snapshot(path, user_id, exported["embedder"], exported["ids"], exported["documents"],
+                   exported["metadatas"], exported["vectors"])
+    logger.info(f"Exported {len(exported['ids'])} items for user {user_id} to {path}")
+    return True
+
+def import_tenant(path, user_id=None):
+    """Load a snapshot into a tenant's index (by default the one it came from)."""
+    from chroma_utils import import_user_index
+
+    snapshot = read_snapshot(path)
+    return import_user_index(
+        user_id or snapshot["user_id"], snapshot["embedder"], snapshot["ids"],
+        snapshot["documents"], snapshot["metadatas"], snapshot["vectors"]
+    )
+
+def stored_user_ids():
+    """User IDs of every tenant stored on this node."""
+    from chroma_utils import shard_map
+
+    names = shard_map.tenants()
+    return sorted(name[len("user_"):-len("_data")] for name in names
+                  if name.startswith("user_") and name.endswith("_data"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and import tenant index snapshots")
+    parser.add_argument("command", choices=["export", "import", "inspect", "export-all", "import-all"])
+    parser.add_argument("args", nargs="+", help="USER_ID PATH for export, otherwise a PATH or DIR")
+    parser.add_argument("--user", help="Import into this user instead of the snapshot's own")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "export":
+        if len(args.args) != 2:
+            parser.error("export needs USER_ID and PATH")
+        return export_tenant(args.args[0], args.args[1])
+
+    target = args.args[0]
+    if args.command == "import":
+        return import_tenant(target, args.user)
+
+    if args.command == "inspect":
+        snapshot = read_snapshot(target)
+        print(f"user: {snapshot['user_id']}")
+        print(f"items: {len(snapshot['ids'])}, dim: {snapshot['vectors'].shape[1]}")
+        print(f"embedder: {snapshot['embedder'].version}")
+        print(f"size: {os.path.getsize(target) / (1024 * 1024):.2f}MB")
+        return True
+
+    if args.command == "export-all":
+        os.makedirs(target, exist_ok=True)
+        results = [
+            export_tenant(user_id, os.path.join(target, f"{user_id}{SNAPSHOT_SUFFIX}"))
+            for user_id in stored_user_ids()
+        ]
+        print(f"Exported {sum(results)} of {len(results)} tenants to {target}")
+        return all(results)
+
+    started = time.time()
+    paths = sorted(name for name in os.listdir(target) if name.endswith(SNAPSHOT_SUFFIX))
+    results = [import_tenant(os.path.join(target, name)) for name in paths]
+    print(f"Imported {sum(results)} of {len(results)} tenants in {time.time() - started:.1f}s")
+    return all(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,49 @@
+import os
+
+# Strings longer than this are split into passages before embedding
+PASSAGE_MAX_CHARS = int(os.getenv("PASSAGE_MAX_CHARS", "800"))
+
+# Target passage length and overlap between consecutive passages, in characters
+PASSAGE_CHARS = int(os.getenv("PASSAGE_CHARS", "600"))
+PASSAGE_OVERLAP = int(os.getenv("PASSAGE_OVERLAP", "100"))
+
+def split_passages(text, size=None, overlap=None):
+    """Split text into overlapping passages on word boundaries.
+
+    Returns a list of ``(start, passage)`` pairs, where ``start`` is the
+    passage's character offset in ``text``.
+    """
+    size = size or PASSAGE_CHARS
+    overlap = min(overlap if overlap is not None else PASSAGE_OVERLAP, size // 2)
+    passages = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + size, length)
+        if end < length:
+            # Prefer to break at the last space inside the window
+            space = text.rfind(" ", start + size // 2, end)
+            if space != -1:
+                end = space
+        passages.append((start, text[start:end]))
+        if end >= length:
+            break
+        next_start = max(end - overlap, start + 1)
+        # Start the next passage on a word boundary too
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return [(start, passage) for start, passage in passages if passage.strip()]
+
+def merge_passages(passages):
+    """Join ``(start, passage)`` pairs from one field, dropping the overlaps."""
+    merged = ""
+    covered = 0
+    for start, passage in sorted(passages):
+        if not merged:
+            merged = passage
+        elif start >= covered:
+            merged = f"{merged} {passage}"
+        else:
+            merged = f"{merged}{passage[covered - start:]}"
+        covered = max(covered, start + len(passage))
+    return merged
@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Memory the process may spend on loaded tenant indexes, ChromaDB's HNSW
+# segments included, before idle ones are unloaded
+TENANT_MEMORY_BUDGET_MB = int(os.getenv("TENANT_MEMORY_BUDGET_MB", "512"))
+
+# Tenants not queried for this many seconds are unloaded regardless of budget (0 disables)
+TENANT_IDLE_SECONDS = int(os.getenv("TENANT_IDLE_SECONDS", "1800"))
+
+# Minimum seconds between idle sweeps
+_SWEEP_INTERVAL = 60
+
+class TenantResidency:
+    """Least-recently-used bookkeeping of which tenants are loaded in memory.
+
+    Callers ``touch`` a tenant whenever they use its in-memory state and
+    report its size when they know it; ``victims`` then names the tenants
+    to unload, least recently used first, so that the total stays within
+    ``budget_bytes`` and nobody stays loaded longer than ``idle_seconds``
+    without being used. Unloading itself is up to the caller.
+    """
+
+    def __init__(self, budget_bytes=TENANT_MEMORY_BUDGET_MB * 1024 * 1024,
+                 idle_seconds=TENANT_IDLE_SECONDS):
+        self.budget_bytes = budget_bytes
+        self.idle_seconds = idle_seconds
+        # name -> [last_access, size_bytes or None], least recent first
+        self._tenants = OrderedDict()
+        self._total = 0
+        self._last_sweep = time.time()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def touch(self, name, size=None):
+        """Record a use of a tenant, optionally with its current size in bytes."""
+        with self._lock:
+            entry = self._tenants.get(name)
+            if entry is None:
+                entry = [0.0, None]
+                self._tenants[name] = entry
+            else:
+                self._tenants.move_to_end(name)
+            entry[0] = time.time()
+            if size is not None:
+                self._total += size - (entry[1] or 0)
+                entry[1] = size
+
+    def needs_size(self, name):
+        """Whether a tenant's size is unknown, e.g. after it was reloaded."""
+        entry = self._tenants.get(name)
+        return entry is None or entry[1] is None
+
+    def resize(self, name):
+        """Forget a tenant's size so the next ``touch`` measures it again."""
+        with self._lock:
+            entry = self._tenants.get(name)
+            if entry is not None:
+                self._total -= entry[1] or 0
+                entry[1] = None
+
+    def remove(self, name):
+        """Stop tracking a tenant, e.g. once it has been unloaded."""
+        with self._lock:
+            entry = self._tenants.pop(name, None)
+            if entry is not None:
+                self._total -= entry[1] or 0
+
+    def victims(self, keep=None):
+        """Tenants to unload now, least recently used first.
+
+        ``keep`` (the tenant being served) is never chosen. Victims are
+        removed from tracking; they are tracked again on their next use.
+        """
+        now = time.time()
+        chosen = []
+        with self._lock:
+            if self.idle_seconds and now - self._last_sweep >= _SWEEP_INTERVAL:
+                self._last_sweep = now
+                for name, (last_access, _) in self._tenants.items():
+                    if name != keep and now - last_access > self.idle_seconds:
+                        chosen.append(name)
+            total = self._total - sum(self._tenants[name][1] or 0 for name in chosen)
+            for name, (_, size) in self._tenants.items():
+                if total <= self.budget_bytes:
+                    break
+                if name != keep and name not in chosen:
+                    chosen.append(name)
+                    total -= size or 0
+            for name in chosen:
+                entry = self._tenants.pop(name)
+                self._total -= entry[1] or 0
+            self.evictions += len(chosen)
+        if chosen:
+            logger.info(f"Unloading {len(chosen)} idle tenants, {total / (1024 * 1024):.1f}MB stays resident")
+        return chosen
+
+    def stats(self):
+        """Resident tenants with their sizes and idle times, most recent first."""
+        now = time.time()
+        with self._lock:
+            tenants = [
+                {
+                    "collection": name,
+                    "bytes": size or 0,
+                    "idle_seconds": round(now - last_access, 1)
+                }
+                for name, (last_access, size) in reversed(self._tenants.items())
+            ]
+            return {
+                "resident_tenants": len(tenants),
+                "resident_bytes": self._total,
+                "budget_bytes": self.budget_bytes,
+                "evictions": self.evictions,
+                "tenants": tenants
+            }
@@ -0,0 +1,71 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from chroma_utils import get_recent_tenants, warm_user
+
+logger = logging.getLogger(__name__)
+
+# How many of the most recently active tenants to load at startup (0 disables)
+TENANT_WARM_LIMIT = int(os.getenv("TENANT_WARM_LIMIT", "50"))
+
+# Threads loading tenants in parallel
+TENANT_WARM_WORKERS = int(os.getenv("TENANT_WARM_WORKERS", "4"))
+
+class TenantWarmer:
+    """Loads recently active tenants in the background after startup.
+
+    The server accepts traffic while this runs; ``ready`` turns True once
+    every listed tenant has been loaded (or failed to), so a readiness
+    probe can hold traffic back until then.
+    """
+
+    def __init__(self, limit=TENANT_WARM_LIMIT, workers=TENANT_WARM_WORKERS):
+        self.limit = limit
+        self.workers = max(1, workers)
+        self.ready = limit <= 0
+        self.total = 0
+        self.warmed = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start warming in a daemon thread; calling it again does nothing."""
+        if self._thread is not None or self.ready:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tenant-warmer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        started = time.time()
+        try:
+            user_ids = get_recent_tenants(self.limit)
+            self.total = len(user_ids)
+            logger.info(f"Warming {self.total} recently active tenants")
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tenant-warm") as pool:
+                for warmed in pool.map(warm_user, user_ids):
+                    if warmed:
+                        self.warmed += 1
+                    else:
+                        self.failed += 1
+        except Exception as e:
+            logger.error(f"Tenant warm-up failed: {str(e)}")
+        finally:
+            self.seconds = time.time() - started
+            self.ready = True
+            logger.info(f"Warmed {self.warmed}/{self.total} tenants in {self.seconds:.2f}s")
+
+    def status(self):
+        """Progress of the warm-up, for the health endpoint."""
+        return {
+            "ready": self.ready,
+            "total": self.total,
+            "warmed": self.warmed,
+            "failed": self.failed,
+            "seconds": round(self.seconds, 2)
+        }